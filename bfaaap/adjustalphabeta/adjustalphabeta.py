@@ -8,46 +8,131 @@ import numpy as np
 import math
 import copy
 
-def giveblackarea(img_input):
-    img = copy.copy(img_input)
-    #http://labs.eecs.tottori-u.ac.jp/sd/Member/oyamada/OpenCV/html/py_tutorials/py_imgproc/py_thresholding/py_thresholding.html
-    img = cv2.cvtColor(img, cv2.COLOR_RGB2GRAY)
-    img = cv2.medianBlur(img,5)
+from instrumentation.instrumentation import instrument, count
+
+#cv2.line(thickness=2) paints the rows y-1, y, y+1 of a horizontal line at y
+LINE_HALF_THICKNESS = 1
+#medianBlur(5) reaches 2 rows and adaptiveThreshold(11) reaches 5 rows
+FILTER_REACH = 2 + 5
+#a line at y can change the binarized rows y-8 to y+8 only
+BAND = LINE_HALF_THICKNESS + FILTER_REACH
+#the binarized rows y-8 to y+8 depend on the rows y-15 to y+15 only
+STRIP = BAND + FILTER_REACH
+#lines at least PERIOD rows apart do not interact after binarization
+PERIOD = 2 * BAND + 1
+
+#colors of the staff lines drawn in determine_alphabeta (upper/lower lines: blue; middle line: red)
+LINE_COLOR = (255,0,0)
+MIDDLE_LINE_COLOR = (0,0,255)
+
+#search ranges of alpha and beta
+ALPHAS = [float(alpha_pre / 1000) for alpha_pre in range(-5, 30)]
+BETAS = [float(beta_pre / 10000) for beta_pre in range(-40, 40)]
+
+#a row belongs to a staff line if at least this fraction of the pixels in the row and its two neighbours is black
+STAFFLINE_MIN_FILL = 0.5
+#runs of staff-line rows separated by at most this number of rows are one line
+STAFFLINE_MAX_GAP = 2
+#the staff lines found directly are used only at or above this confidence (otherwise alpha and beta are searched)
+MIN_CONFIDENCE = 0.6
+#windows of five peaks within this confidence of the best one are regarded as tied
+CONFIDENCE_TIE = 0.02
+
+
+def binarizeGray(img_gray):
+    img = cv2.medianBlur(img_gray,5)
     img_processed = cv2.adaptiveThreshold(img,255,cv2.ADAPTIVE_THRESH_GAUSSIAN_C,\
             cv2.THRESH_BINARY,11,2)
+    return img_processed
+
+def binarize(img_input):
+    #http://labs.eecs.tottori-u.ac.jp/sd/Member/oyamada/OpenCV/html/py_tutorials/py_imgproc/py_thresholding/py_thresholding.html
+    img = cv2.cvtColor(img_input, cv2.COLOR_RGB2GRAY)
+    return binarizeGray(img)
+
+def giveblackarea(img_input):
+    img_processed = binarize(img_input)
     whole_area = img_processed.size
     whitePixels = cv2.countNonZero(img_processed)
     blackPixels = whole_area - whitePixels
     # print(f'blackPixelsは{blackPixels}')
     return blackPixels
 
+def giveGrayValue(color):
+    #the gray value of a color as cv2.cvtColor(COLOR_RGB2GRAY) converts it, e.g., to draw the staff lines on a gray image
+    return int(cv2.cvtColor(np.array([[color]], dtype=np.uint8), cv2.COLOR_RGB2GRAY)[0, 0])
+
+
+class BinarizedImage:
+    #an image (e.g., a page or a measure) with its grayscale, median-blurred and binarized (adaptive threshold) images,
+    #each computed at most once on demand; crop() gives the same object for a region whose images are views of the computed ones
+    #(the blurred and binarized views are filtered as a part of the whole image, not as a separate image)
+    def __init__(self, img, gray=None, blurred=None, binary=None):
+        self.img = img
+        self._gray = gray
+        self._blurred = blurred
+        self._binary = binary
+
+    @property
+    def shape(self):
+        return self.img.shape
+
+    @property
+    def gray(self):
+        if self._gray is None:
+            self._gray = cv2.cvtColor(self.img, cv2.COLOR_RGB2GRAY) if self.img.ndim == 3 else self.img
+        return self._gray
+
+    @property
+    def blurred(self):
+        if self._blurred is None:
+            self._blurred = cv2.medianBlur(self.gray,5)
+        return self._blurred
+
+    @property
+    def binary(self):
+        if self._binary is None:
+            self._binary = cv2.adaptiveThreshold(self.blurred,255,cv2.ADAPTIVE_THRESH_GAUSSIAN_C,\
+                cv2.THRESH_BINARY,11,2)
+        return self._binary
+
+    def crop(self, top, bottom, left=0, right=None):
+        def giveView(img):
+            return None if img is None else img[top:bottom, left:right]
+        return BinarizedImage(self.img[top:bottom, left:right], giveView(self._gray), giveView(self._blurred), giveView(self._binary))
+
 
-def determine_alphabeta(img_input):
-   
-    #determine alpha and beta in the negaposi image
+def giveBinarizedImage(img_input):
+    #img_input: an image or a BinarizedImage
+    return img_input if isinstance(img_input, BinarizedImage) else BinarizedImage(img_input)
+
+
+def drawStaffLines(img_copy, staffmiddle, heightInterval):
+    for i in range(0,3):
+        #draw an upper and a lower line:blue
+        upper_line_position = int(staffmiddle - 2*heightInterval*i)
+        if upper_line_position >= 0:
+            img_copy = cv2.line(img_copy,(0,upper_line_position),(416,upper_line_position),LINE_COLOR,2)
+        lower_line_position = int(staffmiddle + 2*heightInterval*i)
+        if upper_line_position <= 416:
+            img_copy = cv2.line(img_copy,(0,lower_line_position),(416,lower_line_position),LINE_COLOR,2)
+    #draw a middle line:red and title in the image
+    img_copy = cv2.line(img_copy,(0,staffmiddle),(416,staffmiddle),MIDDLE_LINE_COLOR,2)
+    return img_copy
+
+
+def searchalphabeta_bruteforce(img_input, alphas=ALPHAS, betas=BETAS):
+    #draw the staff lines for each (alpha, beta) and binarize the whole image each time (reference implementation)
     img_template = copy.copy(img_input)
-    img_copy = copy.copy(img_input)
     height, width, c = img_template.shape
     alpha_best = 0.0
     beta_best = 0.0
     blackarea_minimum = 416 * 416 #the size of img
-    for alpha_pre in range(-5, 30):
-        alpha = float(alpha_pre / 1000)
-        for beta_pre in range(-40, 40):
-            beta = float(beta_pre / 10000)
+    for alpha in alphas:
+        for beta in betas:
             staffmiddle = int(0.5*416 + alpha*416)
             heightInterval =  int(height/(8 +2*(8*1.2)) + beta*416)
-            img_copy = copy.copy(img_template)
-            for i in range(0,3):
-                #draw an upper and a lower line:blue
-                upper_line_position = int(staffmiddle - 2*heightInterval*i)
-                if upper_line_position >= 0:
-                    img_copy = cv2.line(img_copy,(0,upper_line_position),(416,upper_line_position),(255,0,0),2)
-                lower_line_position = int(staffmiddle + 2*heightInterval*i)
-                if upper_line_position <= 416:
-                    img_copy = cv2.line(img_copy,(0,lower_line_position),(416,lower_line_position),(255,0,0),2)
-            #draw a middle line:red and title in the image
-            img_copy = cv2.line(img_copy,(0,staffmiddle),(416,staffmiddle),(0,0,255),2)
+            img_copy = drawStaffLines(copy.copy(img_template), staffmiddle, heightInterval)
             blackarea = giveblackarea(img_copy)
             if blackarea < blackarea_minimum:
                 alpha_best = alpha
@@ -56,3 +141,148 @@ def determine_alphabeta(img_input):
     return alpha_best, beta_best
 
 
+def giveLineCosts(binarized_img, black_in_eachrow, rows, color):
+    #return {row: the increase of black pixels when a line is drawn at the row}
+    #lines PERIOD rows apart are drawn in one strip and binarized together; only rows near the lines are processed
+    #the lines are drawn on the cached gray image with the gray value of color (the same pixels as drawing in color and converting)
+    height = binarized_img.shape[0]
+    gray_value = giveGrayValue(color)
+    line_costs = {}
+    rows = sorted(set(rows))
+    for residue in range(PERIOD):
+        rows_in_pass = [row for row in rows if row % PERIOD == residue]
+        if len(rows_in_pass) == 0:
+            continue
+        top = max(0, rows_in_pass[0] - STRIP)
+        bottom = min(height, rows_in_pass[-1] + STRIP + 1)
+        if top >= bottom:
+            for row in rows_in_pass:
+                line_costs[row] = 0
+            continue
+        img_strip = binarized_img.crop(top, bottom).gray.copy()
+        for row in rows_in_pass:
+            img_strip = cv2.line(img_strip,(0,row - top),(416,row - top),gray_value,2)
+        black_in_eachrow_strip = np.count_nonzero(binarizeGray(img_strip) == 0, axis=1)
+        cumulative_diff = np.concatenate(([0], np.cumsum(black_in_eachrow_strip - black_in_eachrow[top:bottom])))
+        for row in rows_in_pass:
+            band_top = min(max(row - BAND, top), bottom) - top
+            band_bottom = max(min(row + BAND + 1, bottom), top) - top
+            line_costs[row] = int(cumulative_diff[band_bottom] - cumulative_diff[band_top])
+    return line_costs
+
+
+def searchalphabeta(img_input, alphas=ALPHAS, betas=BETAS):
+    #same result as searchalphabeta_bruteforce:
+    #the image is binarized once and the black area of each (alpha, beta) is the base black area plus the costs of its lines
+    #img_input: an image or a BinarizedImage (e.g., shared with findstafflines)
+    binarized_img = giveBinarizedImage(img_input)
+    height, width, c = binarized_img.shape
+    black_in_eachrow = np.count_nonzero(binarized_img.binary == 0, axis=1)
+    blackarea_base = int(black_in_eachrow.sum())
+
+    #staffmiddle and heightInterval of each candidate as in searchalphabeta_bruteforce
+    staffmiddles = (0.5*416 + np.array(alphas, dtype=np.float64)*416).astype(np.int64)
+    heightIntervals = (height/(8 +2*(8*1.2)) + np.array(betas, dtype=np.float64)*416).astype(np.int64)
+    i = np.array([1, 2])
+    upper_line_positions = staffmiddles[:, None, None] - 2*heightIntervals[None, :, None]*i
+    lower_line_positions = staffmiddles[:, None, None] + 2*heightIntervals[None, :, None]*i
+    isUpperDrawn = upper_line_positions >= 0
+    isLowerDrawn = upper_line_positions <= 416
+
+    rows = np.concatenate((upper_line_positions[isUpperDrawn], lower_line_positions[isLowerDrawn]))
+    line_costs = giveLineCosts(binarized_img, black_in_eachrow, rows.tolist(), LINE_COLOR)
+    middle_line_costs = giveLineCosts(binarized_img, black_in_eachrow, staffmiddles.tolist(), MIDDLE_LINE_COLOR)
+    #look up the cost of each line; lines which are not drawn cost nothing
+    row_offset = min(rows.min(), 0)
+    line_cost_array = np.zeros(max(rows.max(), height) - row_offset + 1, dtype=np.int64)
+    for row, line_cost in line_costs.items():
+        line_cost_array[row - row_offset] = line_cost
+    upper_costs = np.where(isUpperDrawn, line_cost_array[np.clip(upper_line_positions - row_offset, 0, len(line_cost_array) - 1)], 0)
+    lower_costs = np.where(isLowerDrawn, line_cost_array[np.clip(lower_line_positions - row_offset, 0, len(line_cost_array) - 1)], 0)
+    middle_costs = np.array([middle_line_costs[staffmiddle] for staffmiddle in staffmiddles.tolist()], dtype=np.int64)
+    blackareas = blackarea_base + middle_costs[:, None] + upper_costs.sum(axis=2) + lower_costs.sum(axis=2)
+
+    #lines closer than PERIOD interact, so that such candidates are binarized as a whole
+    for j, heightInterval in enumerate(heightIntervals):
+        if 2*heightInterval < PERIOD:
+            for k, staffmiddle in enumerate(staffmiddles):
+                blackareas[k, j] = giveblackarea(drawStaffLines(copy.copy(binarized_img.img), int(staffmiddle), int(heightInterval)))
+
+    #the first minimum in the order of the brute-force search
+    k, j = np.unravel_index(np.argmin(blackareas), blackareas.shape)
+    if blackareas[k, j] >= 416 * 416:
+        return 0.0, 0.0
+    return alphas[k], betas[j]
+
+
+def findstafflines(img_input):
+    #find the five staff lines from the peaks of the horizontal projection of black pixels
+    #return staffmiddle (the row of the middle line), heightInterval (half of the line spacing) and a confidence in [0, 1]
+    #img_input: an image or a BinarizedImage
+    binarized_img = giveBinarizedImage(img_input)
+    height, width, c = binarized_img.shape
+    ret, img_processed = cv2.threshold(binarized_img.gray,0,255,cv2.THRESH_BINARY+cv2.THRESH_OTSU)
+    fill_in_eachrow = np.count_nonzero(img_processed == 0, axis=1) / width
+    #a slightly tilted line is spread over a few rows, so that the fills of 3 neighbouring rows are summed up
+    fill_in_3rows = np.convolve(fill_in_eachrow, np.ones(3), mode='same')
+
+    #runs of rows filled enough to be a part of a staff line
+    line_rows = np.flatnonzero(fill_in_3rows >= STAFFLINE_MIN_FILL)
+    if len(line_rows) == 0:
+        return 0.0, 0.0, 0.0
+    run_starts = np.concatenate(([0], np.flatnonzero(np.diff(line_rows) > STAFFLINE_MAX_GAP + 1) + 1))
+    run_ends = np.concatenate((run_starts[1:], [len(line_rows)]))
+    centers = []
+    strengths = []
+    for start, end in zip(run_starts, run_ends):
+        rows = np.arange(line_rows[start], line_rows[end - 1] + 1)
+        centers.append(np.average(rows, weights=fill_in_eachrow[rows] + 1e-9))
+        strengths.append(min(1.0, fill_in_3rows[rows].max()))
+    centers = np.array(centers)
+    strengths = np.array(strengths)
+    if len(centers) < 5:
+        return 0.0, 0.0, 0.0
+
+    #the five consecutive peaks spaced most evenly (the one nearest to the center of the image among those within CONFIDENCE_TIE of the best)
+    windows = []
+    for i in range(0, len(centers) - 4):
+        spacings = np.diff(centers[i:i + 5])
+        spacing_mean = spacings.mean()
+        regularity = 1.0 - (spacings.max() - spacings.min()) / spacing_mean
+        confidence = float(np.clip(min(regularity, strengths[i:i + 5].min()), 0.0, 1.0))
+        windows.append((confidence, float(centers[i:i + 5].mean()), float(spacing_mean / 2)))
+    confidence_max = max(confidence for confidence, staffmiddle, heightInterval in windows)
+    confidence_best, staffmiddle_best, heightInterval_best = min(
+        (window for window in windows if window[0] >= confidence_max - CONFIDENCE_TIE),
+        key=lambda window: abs(window[1] - 0.5*height))
+    return staffmiddle_best, heightInterval_best, confidence_best
+
+
+def determine_alphabeta_from_stafflines(img_input):
+    #alpha and beta (staffmiddle = 0.5 + alpha, heightInterval = 1/(8+2*(8*1.2)) + beta in the normalized coordinates) without search
+    height, width, c = img_input.shape
+    staffmiddle, heightInterval, confidence = findstafflines(img_input)
+    alpha = staffmiddle/height - 0.5
+    beta = heightInterval/height - 1.0/(8 +2*(8*1.2))
+    return alpha, beta, confidence
+
+
+@instrument('determine_alphabeta')
+def determine_alphabeta_and_isSearched(img_input, alphas=ALPHAS, betas=BETAS, min_confidence=MIN_CONFIDENCE):
+    #determine alpha and beta in the negaposi image and whether they were searched (i.e., the staff lines were unclear)
+    #the staff lines are found directly, and alpha and beta are searched in alphas and betas only if they are unclear
+    #(the gray image is computed once for both)
+    binarized_img = giveBinarizedImage(img_input)
+    alpha, beta, confidence = determine_alphabeta_from_stafflines(binarized_img)
+    if confidence >= min_confidence:
+        return alpha, beta, False
+    alpha, beta = searchalphabeta(binarized_img, alphas, betas)
+    return alpha, beta, True
+
+
+def determine_alphabeta(img_input, alphas=ALPHAS, betas=BETAS, min_confidence=MIN_CONFIDENCE):
+    #determine alpha and beta in the negaposi image (see determine_alphabeta_and_isSearched)
+    alpha, beta, isSearched = determine_alphabeta_and_isSearched(img_input, alphas, betas, min_confidence)
+    if isSearched:
+        count('alpha/beta searched')
+    return alpha, beta
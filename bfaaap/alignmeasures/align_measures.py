@@ -2,7 +2,9 @@
 
 import glob
 import os
-import copy
+import statistics
+
+from instrumentation.instrumentation import instrument
 
 #To obtain measures in a list [measures]
 def collect_measures(txtlines): #sorted in the Y direction
@@ -28,52 +30,46 @@ def collect_measures(txtlines): #sorted in the Y direction
     return measures_sorted
 
 
-def grouping_measures(measures): # to group the measures in the X direction
-    measures_copy1 = copy.copy(measures)
-    measures_copy2 = copy.copy(measures)
-    
-    staves = []#initialize staves
-    for measure in measures_copy1:
-        if (measure['label'] == '0') or (measure['label'] == '1'):
-            
-            #collect measures in a stave, the center_y position of which is between the top and the bottom of the measure (X0 or X1) of interest
-            stave = [] # initialize a stave as an element of staves
-            for candidatemeasure in measures_copy2:
-               if  (measure['center_y'] - 0.02) <= candidatemeasure['center_y'] and candidatemeasure['center_y'] <= (measure['center_y'] + 0.02):
-                    
-                    stave.append(candidatemeasure)
-            #sort the resulting measures in the stave in the X-direction
-            
-            stave_sorted = sorted(stave, key=lambda x:x['center_x'])
-            staves.append(stave_sorted)
-    return staves
+#a new staff (row of measures) starts where the gap between the center_y of consecutive measures exceeds this ratio of the median measure height
+ROW_GAP_RATIO = 0.5
+#measures in a row whose left edges are closer than this are overlapping detections of one measure (the left one is kept)
+OVERLAP_LEFT_TOLERANCE = 0.02
 
-def deleteOverlaps(staves_input):
-    staves = copy.copy(staves_input)
-    staves_tmp = copy.copy(staves_input)
-    print('pass through deleteOverlaps(staves_input)')
-    # to remove overlapping x0 and x1
-    for i, stave in enumerate(staves_tmp):
-        if i == 0:
-            continue
-        else:
-            if (staves_tmp[i - 1][0]['center_y'] - 0.01) < stave[0]['center_y'] and stave[0]['center_y'] < (staves_tmp[i - 1][0]['center_y'] + 0.01):
-                print('there is an overlapping x0 or x1, so remove it')
-                staves.remove(stave)
-    # to remove one of overlapping y0 items
-    for i, stave in enumerate(staves_tmp):
-        if len(stave) > 1:
-            for j, eachmeasure in enumerate(stave):
-                if j == 0:
-                    continue
-                else:
-                    if abs(staves_tmp[i][j-1]['left'] - staves_tmp[i][j]['left']) < 0.02:
-                        del staves[i][j]
+def grouping_measures(measures): # to group the measures into staves (rows of measures sorted in the X direction)
+    #sort once by center_y and sweep: the measures are split into rows at the gaps larger than ROW_GAP_RATIO * the median height,
+    #so that the measures of a staff are grouped together even if the staff is inclined (e.g., in a photo)
+    #only the rows having an x0 or x1 measure (label 0 or 1) are staves, as before
+    if len(measures) == 0:
+        return []
+    measures_sorted = sorted(measures, key=lambda x:(x['center_y'], x['center_x']))
+    row_gap = ROW_GAP_RATIO * statistics.median(measure['height'] for measure in measures_sorted)
 
+    staves = []
+    stave = [measures_sorted[0]]
+    for previous_measure, measure in zip(measures_sorted, measures_sorted[1:]):
+        if measure['center_y'] - previous_measure['center_y'] > row_gap:
+            staves.append(stave)
+            stave = []
+        stave.append(measure)
+    staves.append(stave)
+    return [sorted(stave, key=lambda x:(x['center_x'], x['left'])) for stave in staves if any((measure['label'] == '0') or (measure['label'] == '1') for measure in stave)]
+
+def deleteOverlaps(staves_input):
+    # to remove one of overlapping measures (e.g., y0 items detected twice) in each stave sorted in the X direction
+    staves = []
+    for stave in staves_input:
+        adjusted_stave = []
+        for eachmeasure in stave:
+            if len(adjusted_stave) > 0 and abs(adjusted_stave[-1]['left'] - eachmeasure['left']) < OVERLAP_LEFT_TOLERANCE:
+                print('there is an overlapping measure, so remove it')
+                continue
+            adjusted_stave.append(eachmeasure)
+        staves.append(adjusted_stave)
     return staves
 
 
 
+@instrument()
 def generate_measures_in_eachstave_aslist(FILE_PATH):
     # collect .txt files (inferred Yolov5 text filed (.txt)) and extract txtlines from each file
     
@@ -4,7 +4,6 @@ From the sheet music img file path, perform the first detection for staff recogn
 import cv2
 import glob
 import os
-import subprocess
 import shutil
 import numpy as np
 import math
@@ -12,7 +11,6 @@ from enum import Enum, auto
 import copy
 from itertools import chain
 import time
-import subprocess
 
 
 #時間計測start
@@ -32,8 +30,13 @@ FILE_PATH = leveloriginalimg(FILE_PATH)
 #extract staves with measures
 SAVE_DIRECTORY_PATH = os.path.dirname(FILE_PATH) + '/staff'
 
-proc = subprocess.Popen(['python','detect.py', '--weights', '/Users/tomoimacpro/TSh_project/bfaaap/yolov5/weightsstock/last_0.95_staff4_20201230.pt', '--SAVE_PATH', SAVE_DIRECTORY_PATH ,'--img', '416', '--conf', '0.75', '--source', FILE_PATH, '--save-txt'])
-proc.wait()
+from detectsymbols.detectsymbols import detect_staves, write_label_file
+#the leveled page is decoded once: at a reduced resolution for the staff detector (416 pixels) and at full resolution for cropping
+from imagesource.imagesource import PageImageSource
+
+page_source = PageImageSource(FILE_PATH)
+staff_labels = detect_staves(page_source.giveReducedImage())
+write_label_file(staff_labels, SAVE_DIRECTORY_PATH + '/labels/' + os.path.splitext(os.path.basename(FILE_PATH))[0] + '.txt')
 
 
 #perform inference on sheet music
@@ -48,7 +51,7 @@ files_temp = glob.glob(FILE_PATH) #"./tmp/*":beforehand prepare images and Yolov
     #To skip .txt files
 for file_temp in files_temp:
     if file_temp.endswith('jpg') or file_temp.endswith('png'):
-        img = cv2.imread(file_temp)
+        img = page_source.full if file_temp == FILE_PATH else cv2.imread(file_temp)
         dirname = os.path.dirname(file_temp)
         basename = os.path.basename(file_temp)
         cv2.imwrite(dirname + '/staff/labels/' + basename, img)
@@ -78,111 +81,43 @@ areStavesPaired = True
 #         print("Error: Answer must be yes or no") 
    
 
-#excise and enlarge each measure img at 412 x 412 pixels in each staff and stored in musicdata/AAA/measure/staff1/ or staff2/
-from enlargemeasures.enlargeeachmeasure import produceResizedMeasuresFromAlignedStaves
+#excise and enlarge each measure img at 412 x 412 pixels in each staff and keep them in memory as {'measure#000':img, ...}
+from enlargemeasures.enlargeeachmeasure import produceResizedMeasuresFromAlignedStaves, saveMeasureImages, clearMeasureImages
 #in the case of wide staff extraction, set staff_magnification = 1.2
 staff_magnification = 1.2
+#save the leveled measure images in musicdata/AAA/measure/staff1/ or staff2/ (read by systemintegration.py for alpha/beta and useful for debugging)
+#as png, so that alpha and beta are determined from the same pixels as the symbols are detected in
+SAVE_MEASURE_IMAGES = True
 
-produceResizedMeasuresFromAlignedStaves(img_FILE_PATH=FILE_PATH, aligned_staves=staves_with_measures_in_sheetmusic, isPaired=areStavesPaired, upper_margin=staff_magnification, lower_margin=staff_magnification)
+measure_images_staff1, measure_images_staff2 = produceResizedMeasuresFromAlignedStaves(img_FILE_PATH=FILE_PATH, aligned_staves=staves_with_measures_in_sheetmusic, isPaired=areStavesPaired, upper_margin=staff_magnification, lower_margin=staff_magnification, save_images=False, img_input=page_source.full)
+page_source.release()
 
-#level again each measure one by one
-from leveloriginalimg.leveloriginalimg import leveleachmeasure
+#level again each measure one by one in memory
+from leveloriginalimg.leveloriginalimg import levelmeasureimages
 
-MEASURES_STAFF1_PATH = os.path.dirname(FILE_PATH) + '/measure/staff1/*'
-files_temp = glob.glob(MEASURES_STAFF1_PATH)
-for file_temp in files_temp:
-    if file_temp.endswith('jpg') or file_temp.endswith('png'):
-        FILE_DIR_PATH = os.path.dirname(file_temp)
-        FILE_BASENAME = os.path.basename(file_temp)
-        THIS_PATH = FILE_DIR_PATH + '/' + FILE_BASENAME
-        result0 = leveleachmeasure(THIS_PATH)
+levelmeasureimages(measure_images_staff1)
+levelmeasureimages(measure_images_staff2)
 
-MEASURES_STAFF2_PATH = os.path.dirname(FILE_PATH) + '/measure/staff2/*'
-files_temp = glob.glob(MEASURES_STAFF2_PATH)
-for file_temp in files_temp:
-    if file_temp.endswith('jpg') or file_temp.endswith('png'):
-        FILE_DIR_PATH = os.path.dirname(file_temp)
-        FILE_BASENAME = os.path.basename(file_temp)
-        THIS_PATH = FILE_DIR_PATH + '/' + FILE_BASENAME
-        leveleachmeasure(THIS_PATH)
+if SAVE_MEASURE_IMAGES:
+    clearMeasureImages(os.path.dirname(FILE_PATH))
+    saveMeasureImages(os.path.dirname(FILE_PATH), measure_images_staff1, measure_images_staff2, '.png')
 
 
 """
 apply individual models to the measures selected for staff 1 or 2
 """
-#work at the yolov5 directory
-os.chdir('/Users/tomoimacpro/TSh_project/bfaaap/yolov5/')
-
-#processes in parallel
-processes = []
-
-
-# FILE_PATH ='/Users/tomoimacpro/TSh_project/bfaaap/musicdata/testfordetection1/PatheticMov2_1.jpg'
-#image source directory path for either staff1 or staff2
-"""
-#For staff1
-"""
-SOURCE_PATH = os.path.dirname(FILE_PATH) + '/measure/staff1/*'
-
-#body
-SAVE_DIRECTORY_PATH = os.path.dirname(FILE_PATH) + '/staff1/body'
-proc = subprocess.Popen(['python','detect.py', '--weights', '/Users/tomoimacpro/TSh_project/bfaaap/yolov5/weightsstock/last_0.94_body4_20210208.pt', '--SAVE_PATH', SAVE_DIRECTORY_PATH ,'--img', '416', '--conf', '0.60', '--source', SOURCE_PATH, '--save-txt'])
-# proc.wait()
-processes.append((0, proc))
-#armbeam
-SAVE_DIRECTORY_PATH = os.path.dirname(FILE_PATH) + '/staff1/armbeam'
-proc = subprocess.Popen(['python','detect.py', '--weights', '/Users/tomoimacpro/TSh_project/bfaaap/yolov5/weightsstock/last_0.99_armbeam2_20210214.pt', '--SAVE_PATH', SAVE_DIRECTORY_PATH ,'--img', '416', '--conf', '0.60', '--source', SOURCE_PATH, '--save-txt'])
-# proc.wait()
-processes.append((1, proc))
-#accidental
-SAVE_DIRECTORY_PATH = os.path.dirname(FILE_PATH) + '/staff1/accidental'
-proc = subprocess.Popen(['python','detect.py', '--weights', '/Users/tomoimacpro/TSh_project/bfaaap/yolov5/weightsstock/last_0.99_Accidental2_20210209.pt', '--SAVE_PATH', SAVE_DIRECTORY_PATH ,'--img', '416', '--conf', '0.60', '--source', SOURCE_PATH, '--save-txt'])
-# proc.wait()
-processes.append((2, proc))
-#rest
-SAVE_DIRECTORY_PATH = os.path.dirname(FILE_PATH) + '/staff1/rest'
-proc = subprocess.Popen(['python','detect.py', '--weights', '/Users/tomoimacpro/TSh_project/bfaaap/yolov5/weightsstock/last_0.99_rest1_20210107.pt', '--SAVE_PATH', SAVE_DIRECTORY_PATH ,'--img', '416', '--conf', '0.60', '--source', SOURCE_PATH, '--save-txt'])
-# proc.wait()
-processes.append((3, proc))
-#clef
-SAVE_DIRECTORY_PATH = os.path.dirname(FILE_PATH) + '/staff1/clef'
-proc = subprocess.Popen(['python','detect.py', '--weights', '/Users/tomoimacpro/TSh_project/bfaaap/yolov5/weightsstock/last_0.99_Clef3_20210129.pt', '--SAVE_PATH', SAVE_DIRECTORY_PATH ,'--img', '416', '--conf', '0.60', '--source', SOURCE_PATH, '--save-txt'])
-# proc.wait()
-processes.append((4, proc))
-"""
-#For staff2
-"""
-SOURCE_PATH = os.path.dirname(FILE_PATH) + '/measure/staff2/*'
-
-#body
-SAVE_DIRECTORY_PATH = os.path.dirname(FILE_PATH) + '/staff2/body'
-proc = subprocess.Popen(['python','detect.py', '--weights', '/Users/tomoimacpro/TSh_project/bfaaap/yolov5/weightsstock/last_0.94_body4_20210208.pt', '--SAVE_PATH', SAVE_DIRECTORY_PATH ,'--img', '416', '--conf', '0.60', '--source', SOURCE_PATH, '--save-txt'])
-# proc.wait()
-processes.append((5, proc))
-#armbeam
-SAVE_DIRECTORY_PATH = os.path.dirname(FILE_PATH) + '/staff2/armbeam'
-proc = subprocess.Popen(['python','detect.py', '--weights', '/Users/tomoimacpro/TSh_project/bfaaap/yolov5/weightsstock/last_0.99_armbeam2_20210214.pt', '--SAVE_PATH', SAVE_DIRECTORY_PATH ,'--img', '416', '--conf', '0.60', '--source', SOURCE_PATH, '--save-txt'])
-# proc.wait()
-processes.append((6, proc))
-#accidental
-SAVE_DIRECTORY_PATH = os.path.dirname(FILE_PATH) + '/staff2/accidental'
-proc = subprocess.Popen(['python','detect.py', '--weights', '/Users/tomoimacpro/TSh_project/bfaaap/yolov5/weightsstock/last_0.99_Accidental2_20210209.pt', '--SAVE_PATH', SAVE_DIRECTORY_PATH ,'--img', '416', '--conf', '0.60', '--source', SOURCE_PATH, '--save-txt'])
-# proc.wait()
-processes.append((7, proc))
-#rest
-SAVE_DIRECTORY_PATH = os.path.dirname(FILE_PATH) + '/staff2/rest'
-proc = subprocess.Popen(['python','detect.py', '--weights', '/Users/tomoimacpro/TSh_project/bfaaap/yolov5/weightsstock/last_0.99_rest1_20210107.pt', '--SAVE_PATH', SAVE_DIRECTORY_PATH ,'--img', '416', '--conf', '0.60', '--source', SOURCE_PATH, '--save-txt'])
-# proc.wait()
-processes.append((8, proc))
-#clef
-SAVE_DIRECTORY_PATH = os.path.dirname(FILE_PATH) + '/staff2/clef'
-proc = subprocess.Popen(['python','detect.py', '--weights', '/Users/tomoimacpro/TSh_project/bfaaap/yolov5/weightsstock/last_0.99_Clef3_20210129.pt', '--SAVE_PATH', SAVE_DIRECTORY_PATH ,'--img', '416', '--conf', '0.60', '--source', SOURCE_PATH, '--save-txt'])
-# proc.wait()
-processes.append((9, proc))
-
-for i, p in processes:
-    print(f'waiting process {i} to finish')
-    p.wait()
+#all symbol models (body, armbeam, accidental, rest, clef) are loaded once and run in this process
+from detectsymbols.detectsymbols import load_symbol_models, detect_symbols_in_measures, write_labels
+
+load_symbol_models()
+
+for staff, measure_images in ((1, measure_images_staff1), (2, measure_images_staff2)):
+    if len(measure_images) == 0:
+        continue
+    detections = detect_symbols_in_measures(measure_images)
+    #save labels under staff1/body/labels/, staff1/armbeam/labels/, ... for systemintegration.py
+    SAVE_DIRECTORY_PATH = os.path.dirname(FILE_PATH) + '/staff' + str(staff)
+    write_labels(detections, SAVE_DIRECTORY_PATH)
 
 #時間計測end
 elapsed_time = time.time() - start
@@ -0,0 +1,114 @@
+# coding: UTF-8
+""" Detection Cache
+    To skip the Yolov5 models for images which have already been detected with the same weights and settings
+    detections are stored in an sqlite file keyed by (image hash, weights hash, img size, conf/iou thresholds, precision)
+    and the least recently used ones are evicted when the stored detections exceed DETECTION_CACHE_MAX_BYTES
+"""
+import hashlib
+import os
+import sqlite3
+import time
+import numpy as np
+
+DETECTION_CACHE_PATH = os.path.join(os.path.expanduser('~'), '.cache', 'bfaaap', 'detections.sqlite')
+DETECTION_CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+#open connections: {cache_path: connection}
+_connections = {}
+#hashes of weights files: {(weights, mtime, size): hash}
+_weights_hashes = {}
+
+
+def open_cache(cache_path=DETECTION_CACHE_PATH):
+    #open (and create) the cache only once and reuse it afterwards
+    if cache_path not in _connections:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        connection = sqlite3.connect(cache_path)
+        connection.execute('CREATE TABLE IF NOT EXISTS detections (key TEXT PRIMARY KEY, labels BLOB, size INTEGER, last_access REAL)')
+        connection.execute('CREATE INDEX IF NOT EXISTS detections_last_access ON detections (last_access)')
+        _connections[cache_path] = connection
+    return _connections[cache_path]
+
+
+def give_image_hash(img):
+    #hash of the pixels (and the shape) of an image
+    img = np.ascontiguousarray(img)
+    return hashlib.sha1(str(img.shape).encode() + img.tobytes()).hexdigest()
+
+
+def give_weights_hash(weights):
+    #hash of the content of a weights file (computed again only if the file is modified)
+    stat = os.stat(weights)
+    key = (weights, stat.st_mtime, stat.st_size)
+    if key not in _weights_hashes:
+        sha1 = hashlib.sha1()
+        with open(weights, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                sha1.update(chunk)
+        _weights_hashes[key] = sha1.hexdigest()
+    return _weights_hashes[key]
+
+
+def give_cache_key(img_hash, weights_hash, img_size, conf_thres, iou_thres, half):
+    return f'{img_hash}:{weights_hash}:{img_size}:{conf_thres!r}:{iou_thres!r}:{int(half)}'
+
+
+def encode_labels(labels):
+    #label tuples (cls, x, y, w, h, conf) as float64 bytes
+    return np.array(labels, dtype=np.float64).reshape(-1, 6).tobytes()
+
+
+def decode_labels(blob):
+    labels_array = np.frombuffer(blob, dtype=np.float64).reshape(-1, 6)
+    return [(int(label[0]), *label[1:].tolist()) for label in labels_array]
+
+
+def load_cached_labels(keys, cache_path=DETECTION_CACHE_PATH):
+    #return {key: labels} for the keys found in the cache
+    connection = open_cache(cache_path)
+    cached_labels = {}
+    keys = list(set(keys))
+    #sqlite limits the number of parameters in a query
+    for i in range(0, len(keys), 500):
+        keys_chunk = keys[i:i + 500]
+        rows = connection.execute('SELECT key, labels FROM detections WHERE key IN (' + ','.join('?' * len(keys_chunk)) + ')', keys_chunk).fetchall()
+        for key, blob in rows:
+            cached_labels[key] = decode_labels(blob)
+    if len(cached_labels) > 0:
+        now = time.time()
+        connection.executemany('UPDATE detections SET last_access = ? WHERE key = ?', [(now, key) for key in cached_labels])
+        connection.commit()
+    return cached_labels
+
+
+def store_labels(labels_for_eachkey, cache_path=DETECTION_CACHE_PATH, max_bytes=DETECTION_CACHE_MAX_BYTES):
+    #labels_for_eachkey = {key: labels}
+    connection = open_cache(cache_path)
+    now = time.time()
+    rows = []
+    for key, labels in labels_for_eachkey.items():
+        blob = encode_labels(labels)
+        rows.append((key, blob, len(key) + len(blob), now))
+    connection.executemany('INSERT OR REPLACE INTO detections (key, labels, size, last_access) VALUES (?, ?, ?, ?)', rows)
+    evict_least_recently_used(connection, max_bytes)
+    connection.commit()
+
+
+def evict_least_recently_used(connection, max_bytes=DETECTION_CACHE_MAX_BYTES):
+    total_size = connection.execute('SELECT COALESCE(SUM(size), 0) FROM detections').fetchone()[0]
+    if total_size <= max_bytes:
+        return
+    keys_to_delete = []
+    for key, size in connection.execute('SELECT key, size FROM detections ORDER BY last_access'):
+        if total_size <= max_bytes:
+            break
+        keys_to_delete.append((key,))
+        total_size -= size
+    connection.executemany('DELETE FROM detections WHERE key = ?', keys_to_delete)
+
+
+def clear_cache(cache_path=DETECTION_CACHE_PATH):
+    connection = open_cache(cache_path)
+    connection.execute('DELETE FROM detections')
+    connection.commit()
+    connection.execute('VACUUM')
@@ -0,0 +1,169 @@
+# coding: UTF-8
+""" Detect Symbols
+    To run the staff and musical symbol Yolov5 models in one process
+    each model is loaded once and kept resident, and detections are returned as label tuples
+"""
+import os
+import sys
+import numpy as np
+
+#make the yolov5 packages (models, utils) importable as in yolov5/detect.py
+YOLOV5_DIR = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'yolov5'))
+if YOLOV5_DIR not in sys.path:
+    sys.path.insert(0, YOLOV5_DIR)
+
+import torch
+from models.experimental import attempt_load
+from utils.datasets import letterbox
+from utils.general import check_img_size, non_max_suppression, scale_coords, xyxy2xywh
+from utils.torch_utils import select_device
+
+from instrumentation.instrumentation import instrument, span, count
+from detectsymbols.detectioncache import DETECTION_CACHE_PATH, give_image_hash, give_weights_hash, give_cache_key, load_cached_labels, store_labels
+
+WEIGHTS_DIR = YOLOV5_DIR + '/weightsstock'
+STAFF_WEIGHTS = WEIGHTS_DIR + '/last_0.95_staff4_20201230.pt'
+#weights for each category of musical symbols (see the #label# list in makeyolomusicdict/generatedictforxml.py)
+SYMBOL_WEIGHTS = {
+    'body':WEIGHTS_DIR + '/last_0.94_body4_20210208.pt',
+    'armbeam':WEIGHTS_DIR + '/last_0.99_armbeam2_20210214.pt',
+    'accidental':WEIGHTS_DIR + '/last_0.99_Accidental2_20210209.pt',
+    'rest':WEIGHTS_DIR + '/last_0.99_rest1_20210107.pt',
+    'clef':WEIGHTS_DIR + '/last_0.99_Clef3_20210129.pt',
+}
+SYMBOL_CATEGORIES = ('body', 'armbeam', 'accidental', 'rest', 'clef')
+
+IMG_SIZE = 416
+STAFF_CONF_THRES = 0.75
+SYMBOL_CONF_THRES = 0.60
+IOU_THRES = 0.45
+#the number of measure images stacked into one (N,3,416,416) tensor
+BATCH_SIZE = 32
+#reuse the detections of images already detected with the same weights and settings (see detectioncache.py)
+USE_DETECTION_CACHE = True
+
+#resident models: {(weights, device): (model, torch_device)}
+_loaded_models = {}
+
+
+def load_model(weights, device=''):
+    #load a model only once and reuse it afterwards
+    key = (weights, device)
+    if key not in _loaded_models:
+        torch_device = select_device(device)
+        with span('load model', weights=os.path.basename(weights)):
+            model = attempt_load(weights, map_location=torch_device)  # load FP32 model
+        if torch_device.type != 'cpu':
+            model.half()  # half precision only supported on CUDA
+        _loaded_models[key] = (model, torch_device)
+    return _loaded_models[key]
+
+
+def load_symbol_models(categories=SYMBOL_CATEGORIES, device=''):
+    #load all symbol models beforehand (e.g., at the start of a batch job)
+    for category in categories:
+        load_model(SYMBOL_WEIGHTS[category], device)
+
+
+def giveLabelsFromDetection(det, img_shape, img0_shape):
+    #convert one image's detections into normalized label tuples (cls, x, y, w, h, conf) as in detect.py --save-txt
+    labels = []
+    if len(det):
+        gn = torch.tensor(img0_shape)[[1, 0, 1, 0]]  # normalization gain whwh
+        det[:, :4] = scale_coords(img_shape, det[:, :4], img0_shape).round()
+        for *xyxy, conf, cls in reversed(det):
+            xywh = (xyxy2xywh(torch.tensor(xyxy).view(1, 4)) / gn).view(-1).tolist()  # normalized xywh
+            labels.append((int(cls), *xywh, float(conf)))
+    return labels
+
+
+def giveInputTensor(imgs0, imgsz, torch_device, half):
+    #letterbox each BGR image and stack them into one (N,3,H,W) tensor
+    #measure images are already 416 x 416, so that letterbox leaves them unchanged
+    imgs = [letterbox(img0, new_shape=imgsz)[0] for img0 in imgs0]
+    img = np.stack(imgs, 0)
+    # Convert
+    img = img[:, :, :, ::-1].transpose(0, 3, 1, 2)  # BGR to RGB, to Nx3x416x416
+    img = np.ascontiguousarray(img)
+    img = torch.from_numpy(img).to(torch_device)
+    img = img.half() if half else img.float()  # uint8 to fp16/32
+    img /= 255.0  # 0 - 255 to 0.0 - 1.0
+    return img
+
+
+def detect_in_batch(imgs0, weights, img_size=IMG_SIZE, conf_thres=SYMBOL_CONF_THRES, iou_thres=IOU_THRES, device='', batch_size=BATCH_SIZE, use_cache=USE_DETECTION_CACHE, cache_path=DETECTION_CACHE_PATH):
+    #imgs0: a list of BGR images of the same shape (e.g., 416 x 416 measure images)
+    #return a list of label lists in the order of imgs0
+    labels_in_eachimg = [None] * len(imgs0)
+    if use_cache:
+        half = select_device(device).type != 'cpu'
+        weights_hash = give_weights_hash(weights)
+        keys = [give_cache_key(give_image_hash(img0), weights_hash, img_size, conf_thres, iou_thres, half) for img0 in imgs0]
+        cached_labels = load_cached_labels(keys, cache_path)
+        for k, key in enumerate(keys):
+            if key in cached_labels:
+                labels_in_eachimg[k] = cached_labels[key]
+        count('detection cache hits', len(imgs0) - labels_in_eachimg.count(None))
+    #the model is run (and loaded) only for the images not in the cache
+    indices_to_detect = [k for k, labels in enumerate(labels_in_eachimg) if labels is None]
+    if len(indices_to_detect) == 0:
+        return labels_in_eachimg
+    count('images detected', len(indices_to_detect))
+    model, torch_device = load_model(weights, device)
+    half = torch_device.type != 'cpu'
+    imgsz = check_img_size(img_size, s=model.stride.max())
+    for i in range(0, len(indices_to_detect), batch_size):
+        indices_batch = indices_to_detect[i:i + batch_size]
+        imgs0_batch = [imgs0[k] for k in indices_batch]
+        img = giveInputTensor(imgs0_batch, imgsz, torch_device, half)
+        with torch.no_grad():
+            pred = model(img)[0]
+        # Apply NMS to the whole batch
+        pred = non_max_suppression(pred, conf_thres, iou_thres)
+        for det, img0, k in zip(pred, imgs0_batch, indices_batch):
+            labels_in_eachimg[k] = giveLabelsFromDetection(det, img.shape[2:], img0.shape)
+    if use_cache:
+        store_labels({keys[k]: labels_in_eachimg[k] for k in indices_to_detect}, cache_path)
+    return labels_in_eachimg
+
+
+def detect_in_image(img0, weights, img_size=IMG_SIZE, conf_thres=SYMBOL_CONF_THRES, iou_thres=IOU_THRES, device=''):
+    #img0: BGR image as read by cv2.imread
+    return detect_in_batch([img0], weights, img_size=img_size, conf_thres=conf_thres, iou_thres=iou_thres, device=device)[0]
+
+
+@instrument()
+def detect_staves(img0, conf_thres=STAFF_CONF_THRES, device=''):
+    #detect measures (x0, x1, y0) in a whole sheet music image
+    return detect_in_image(img0, STAFF_WEIGHTS, conf_thres=conf_thres, device=device)
+
+
+def detect_symbols_in_measures(measure_images, categories=SYMBOL_CATEGORIES, conf_thres=SYMBOL_CONF_THRES, device='', batch_size=BATCH_SIZE):
+    #measure_images = {'measure#000':img, 'measure#001':img, ...}
+    #return detections = {'body':{'measure#000':[(cls, x, y, w, h, conf), ...], ...}, 'armbeam':{...}, ...}
+    names = list(measure_images.keys())
+    imgs0 = [measure_images[nameOfMeasure] for nameOfMeasure in names]
+    detections = {}
+    for category in categories:
+        with span('detect ' + category, measures=len(imgs0)):
+            labels_in_eachmeasure = detect_in_batch(imgs0, SYMBOL_WEIGHTS[category], conf_thres=conf_thres, device=device, batch_size=batch_size) if len(imgs0) > 0 else []
+        count(category + ' symbols', sum(len(labels) for labels in labels_in_eachmeasure))
+        detections[category] = dict(zip(names, labels_in_eachmeasure))
+    return detections
+
+
+def write_label_file(labels, txtfile_PATH, save_conf=False):
+    #write label tuples in the Yolov5 text format (label, x, y, w, h[, conf])
+    os.makedirs(os.path.dirname(txtfile_PATH), exist_ok=True)
+    with open(txtfile_PATH, 'w') as f:
+        for label in labels:
+            line = label if save_conf else label[:5]
+            f.write(('%g ' * len(line)).rstrip() % line + '\n')
+
+
+def write_labels(detections, SAVE_DIRECTORY_PATH, save_conf=False):
+    #write detections as SAVE_DIRECTORY_PATH/<category>/labels/measure#NNN.txt (the layout read by generatedictforxml.py)
+    for category, labels_in_eachmeasure in detections.items():
+        for nameOfMeasure, labels in labels_in_eachmeasure.items():
+            if len(labels) > 0:
+                write_label_file(labels, SAVE_DIRECTORY_PATH + '/' + category + '/labels/' + nameOfMeasure + '.txt', save_conf=save_conf)
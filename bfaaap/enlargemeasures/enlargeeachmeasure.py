@@ -6,7 +6,9 @@ import cv2
 import glob
 import os
 import shutil
-import copy
+import numpy as np
+
+from instrumentation.instrumentation import instrument, count
 
 
 def produce_enlargedmeasures(img, txtlines, upper_margin, lower_margin):#upper margin: upper magnification; lower margin: lower magnification
@@ -84,17 +86,16 @@ def enlarge_eachmeasure_in_eachstaff(FILE_PATH, pairedStaff=True, upper_margin=1
 # enlarge_eachmeasure_in_eachfile(upper_margin=1.0, lower_margin=1.0)
 
 
-def giveResizedMeasureImage(measureOfInterest, img_input, img_width, img_height, upper_margin, lower_margin):
-    eachmeasure = copy.copy(measureOfInterest)
-    img = copy.copy(img_input)
+#Yolov5 input size: dim = (width, height)
+MEASURE_IMAGE_DIM = (416, 416)
+
+def giveMeasureROI(measureOfInterest, img_width, img_height, upper_margin, lower_margin):
     # set a processed area roi(left(x1), top(y1), right(x2), bottom(y2))
-    left = int(eachmeasure['left']*img_width)
-    top = int(eachmeasure['top']*img_height)
-    right =int(eachmeasure['right']*img_width)
-    bottom = int(eachmeasure['bottom']*img_height)
-    width = right - left
+    left = int(measureOfInterest['left']*img_width)
+    top = int(measureOfInterest['top']*img_height)
+    right =int(measureOfInterest['right']*img_width)
+    bottom = int(measureOfInterest['bottom']*img_height)
     height = bottom - top
-    print('eachmeasure has a width of {} and a height of {}'.format(width, height))
     #add upper and lower margins to select roi (region of interest)
     mod_top = top - int(upper_margin * height)
     mod_bottom = bottom + int(lower_margin * height)
@@ -102,24 +103,36 @@ def giveResizedMeasureImage(measureOfInterest, img_input, img_width, img_height,
         mod_top = 0
     if mod_bottom > img_height:
         mod_bottom = img_height
-    roi = (left, mod_top, right, mod_bottom)
+    return (left, mod_top, right, mod_bottom)
+
+
+@instrument()
+def giveResizedMeasureImage(measureOfInterest, img_input, img_width, img_height, upper_margin, lower_margin, dst=None):
+    #img_input is not copied: the roi is a view of the page and is resized into dst (e.g., an item of a batch buffer) if given
+    roi = giveMeasureROI(measureOfInterest, img_width, img_height, upper_margin, lower_margin)
     # To select the roi in the img
     # [top:bottom, left:right] 
-    s_roi = img[roi[1]: roi[3], roi[0]: roi[2]]
+    s_roi = img_input[roi[1]: roi[3], roi[0]: roi[2]]
     #resize s_roi (img) to 416 x 416 (Yolov5 input size)
-    dim = (416, 416)#dim = (width, height)
-    resized_measure_img = cv2.resize(s_roi, dim, interpolation = cv2.INTER_AREA)
+    resized_measure_img = cv2.resize(s_roi, MEASURE_IMAGE_DIM, dst=dst, interpolation = cv2.INTER_AREA)
     return resized_measure_img
 
 
+def giveMeasureImageBatch(number_of_measures, img):
+    #a preallocated buffer (N, 416, 416, 3) for the resized measure images of a page
+    return np.empty((number_of_measures, MEASURE_IMAGE_DIM[1], MEASURE_IMAGE_DIM[0]) + img.shape[2:], dtype=img.dtype)
 
 
-
-def produceResizedMeasuresFromAlignedStaves(img_FILE_PATH, aligned_staves, isPaired=True, upper_margin=1.0, lower_margin=1.0):#upper margin: upper magnification; lower margin: lower magnification
+def produceResizedMeasuresFromAlignedStaves(img_FILE_PATH, aligned_staves, isPaired=True, upper_margin=1.0, lower_margin=1.0, save_images=True, img_input=None):#upper margin: upper magnification; lower margin: lower magnification
+    #return the resized measure images as {'measure#000':img, ...} for staff1 and staff2
+    #if save_images is False, nothing is written under ./measure/ (in-memory pipeline)
+    #img_input: the page already decoded from img_FILE_PATH (e.g., PageImageSource.full), so as not to decode it again
     
     # to return each resized measure image
     return_resizedimages_for_staff1 = []
     return_resizedimages_for_staff2 = []
+    measure_images_staff1 = {}
+    measure_images_staff2 = {}
 
     measures_in_staff1 = []
     measures_in_staff2 = []
@@ -146,40 +159,56 @@ def produceResizedMeasuresFromAlignedStaves(img_FILE_PATH, aligned_staves, isPai
             dirname = os.path.dirname(file)
             image_ext = os.path.splitext(os.path.basename(file))[1]
             # image_height, image_width
-            img = cv2.imread(file)
+            img = cv2.imread(file) if img_input is None else img_input
             img_height, img_width = img.shape[:2]
-            #resize each image for staff1 or, if any, staff2
-            if len(measures_in_staff1) > 0 and isPaired:
-                for eachmeasure in measures_in_staff1:
-                    resized_measure_img = giveResizedMeasureImage(eachmeasure, img, img_width, img_height, upper_margin, lower_margin)
-                    #save each resized measure image in return_images = [resized_measure_image]
-                    return_resizedimages_for_staff1.append(resized_measure_img)
-            if len(measures_in_staff2) > 0 and isPaired:
-                for eachmeasure in measures_in_staff2:
-                    resized_measure_img = giveResizedMeasureImage(eachmeasure, img, img_width, img_height, upper_margin, lower_margin)
-                    #save each resized measure image in return_images = [resized_measure_image]
-                    return_resizedimages_for_staff2.append(resized_measure_img)
-            if len(measures_in_staff1) > 0 and not isPaired:
-                    for eachmeasure in measures_in_staff1:
-                        resized_measure_img = giveResizedMeasureImage(eachmeasure, img, img_width, img_height, upper_margin, lower_margin)
-                        #save each resized measure image in return_images = [resized_measure_image]
-                        return_resizedimages_for_staff1.append(resized_measure_img)
-            #save the resized images under a directory ./measure/staff1/ or ./measure/staff2/
-            new_dir_path_staff1 = dirname+ '/measure/staff1'
-            new_dir_path_staff2 = dirname+ '/measure/staff2'
-            os.makedirs(new_dir_path_staff1, exist_ok=True)
-            os.makedirs(new_dir_path_staff2, exist_ok=True)
-            if len(return_resizedimages_for_staff1) > 0:
-                #save each resized measure as a file under a directory /measure/staff1/
-                for i, resized_measure_image in enumerate(return_resizedimages_for_staff1):
-                    cv2.imwrite(dirname + '/measure/staff1/' +  'measure#' + '{:0=3}'.format(i) + image_ext, resized_measure_image)
-            if len(return_resizedimages_for_staff2) > 0:
-                #save each resized measure as a file
-                for i, resized_measure_image in enumerate(return_resizedimages_for_staff2):
-                    # print(f'{i}個目のreturn_resizedimages_for_staff2')
-                    cv2.imwrite(dirname + '/measure/staff2/' +  'measure#' + '{:0=3}'.format(i) + image_ext, resized_measure_image)
-
-
-
-
-
+            #the measures to resize for staff1 and, if any, staff2
+            measures_to_resize = []
+            if isPaired:
+                measures_to_resize = [(return_resizedimages_for_staff1, eachmeasure) for eachmeasure in measures_in_staff1] + [(return_resizedimages_for_staff2, eachmeasure) for eachmeasure in measures_in_staff2]
+            else:
+                measures_to_resize = [(return_resizedimages_for_staff1, eachmeasure) for eachmeasure in measures_in_staff1]
+            #each measure image is a view of one batch buffer (one page plus one batch in memory)
+            measure_image_batch = giveMeasureImageBatch(len(measures_to_resize), img)
+            for k, (return_resizedimages, eachmeasure) in enumerate(measures_to_resize):
+                resized_measure_img = giveResizedMeasureImage(eachmeasure, img, img_width, img_height, upper_margin, lower_margin, dst=measure_image_batch[k])
+                #save each resized measure image in return_images = [resized_measure_image]
+                return_resizedimages.append(resized_measure_img)
+            for i, resized_measure_image in enumerate(return_resizedimages_for_staff1):
+                measure_images_staff1['measure#' + '{:0=3}'.format(i)] = resized_measure_image
+            for i, resized_measure_image in enumerate(return_resizedimages_for_staff2):
+                measure_images_staff2['measure#' + '{:0=3}'.format(i)] = resized_measure_image
+            count('measures cropped', len(measure_images_staff1) + len(measure_images_staff2))
+            if save_images:
+                saveMeasureImages(dirname, measure_images_staff1, measure_images_staff2, image_ext)
+    return measure_images_staff1, measure_images_staff2
+
+
+def clearMeasureImages(MEASURE_PARENT_DIR):
+    #remove the measure images of a previous run (the number of measures may differ)
+    for staff in (1, 2):
+        for file in glob.glob(MEASURE_PARENT_DIR + '/measure/staff' + str(staff) + '/measure#*'):
+            os.remove(file)
+
+
+def saveMeasureImages(dirname, measure_images_staff1, measure_images_staff2, image_ext='.jpg'):
+    #save the resized images under a directory ./measure/staff1/ or ./measure/staff2/
+    new_dir_path_staff1 = dirname+ '/measure/staff1'
+    new_dir_path_staff2 = dirname+ '/measure/staff2'
+    os.makedirs(new_dir_path_staff1, exist_ok=True)
+    os.makedirs(new_dir_path_staff2, exist_ok=True)
+    #save each resized measure as a file under a directory /measure/staff1/
+    for nameOfMeasure, resized_measure_image in measure_images_staff1.items():
+        cv2.imwrite(new_dir_path_staff1 + '/' + nameOfMeasure + image_ext, resized_measure_image)
+    #save each resized measure as a file
+    for nameOfMeasure, resized_measure_image in measure_images_staff2.items():
+        cv2.imwrite(new_dir_path_staff2 + '/' + nameOfMeasure + image_ext, resized_measure_image)
+
+
+def load_measure_images(MEASURE_DIR):
+    #read measure#NNN images in a directory (e.g., musicdata/AAA/measure/staff1) as {'measure#000':img, ...}
+    measure_images = {}
+    for file in sorted(glob.glob(MEASURE_DIR + '/*')):
+        if file.endswith('jpg') or file.endswith('png'):
+            namewithoutext = os.path.splitext(os.path.basename(file))[0]
+            measure_images[namewithoutext] = cv2.imread(file)
+    return measure_images
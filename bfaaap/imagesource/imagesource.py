@@ -0,0 +1,54 @@
+# coding: UTF-8
+""" Image Source
+    To decode a sheet music image once and share it among the stages
+    e.g., source = PageImageSource(LEVELED_FILE_PATH); detect_staves(source.giveReducedImage()); crop from source.full
+    the staff detector sees the page at 416 pixels only, so that its input is decoded at a reduced resolution
+    (IMREAD_REDUCED_COLOR_8/4/2: the DCT scaling of the JPEG decoder) without decoding the full page for it
+"""
+import cv2
+
+from instrumentation.instrumentation import span
+
+#the input size of the staff detector
+REDUCED_IMG_SIZE = 416
+#the reduced decodes tried from the smallest
+REDUCED_DECODE_FLAGS = ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4), (2, cv2.IMREAD_REDUCED_COLOR_2))
+
+
+class PageImageSource:
+    #a page image file decoded at most once at full resolution (for cropping) and once at a reduced resolution (for the staff detector)
+    def __init__(self, FILE_PATH):
+        self.FILE_PATH = FILE_PATH
+        self._full = None
+        self._reduced = {}
+
+    @property
+    def full(self):
+        if self._full is None:
+            with span('decode page'):
+                self._full = cv2.imread(self.FILE_PATH)
+            if self._full is None:
+                raise FileNotFoundError(f'cannot read {self.FILE_PATH}')
+        return self._full
+
+    def giveReducedImage(self, img_size=REDUCED_IMG_SIZE):
+        #the smallest decode whose longer side is still at least img_size (the detector only shrinks it further);
+        #the full image if the page is too small to be reduced
+        if img_size in self._reduced:
+            return self._reduced[img_size]
+        reduced = None
+        with span('decode reduced page'):
+            for factor, flag in REDUCED_DECODE_FLAGS:
+                img = cv2.imread(self.FILE_PATH, flag)
+                if img is not None and max(img.shape[:2]) >= img_size:
+                    reduced = img
+                    break
+        if reduced is None:
+            reduced = self.full
+        self._reduced[img_size] = reduced
+        return reduced
+
+    def release(self):
+        #forget the decoded images (e.g., after the last stage using them)
+        self._full = None
+        self._reduced = {}
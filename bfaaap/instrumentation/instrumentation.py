@@ -0,0 +1,106 @@
+# coding: UTF-8
+""" Instrumentation
+    To measure where the time of a run goes: spans (context managers or decorated functions) and counters
+    e.g., with span('crop'): ..., @instrument() def leveloriginalimg(...): ..., count('measures', 24)
+    give_report() sums up the wall and CPU time of each span name with the counters;
+    write_report() saves it as JSON and write_chrome_trace() saves the spans for chrome://tracing (or Perfetto)
+    only the calling process is recorded (e.g., the workers of calibrateMeasures are covered by its span as a whole)
+"""
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+#set False to record nothing
+ENABLED = True
+
+#finished spans: [{'name', 'start', 'wall', 'cpu', 'pid', 'tid', 'args'}, ...] (start/wall in seconds)
+_spans = []
+#counters: {name: count}
+_counters = {}
+_lock = threading.Lock()
+_origin = time.perf_counter()
+
+
+def reset():
+    #forget the spans and counters recorded so far (e.g., at the start of a run)
+    global _origin
+    with _lock:
+        _spans.clear()
+        _counters.clear()
+        _origin = time.perf_counter()
+
+
+@contextmanager
+def span(name, **args):
+    #wall time and CPU time (of the whole process) spent in the with block
+    if not ENABLED:
+        yield
+        return
+    start = time.perf_counter()
+    cpu_start = time.process_time()
+    try:
+        yield
+    finally:
+        wall = time.perf_counter() - start
+        cpu = time.process_time() - cpu_start
+        with _lock:
+            _spans.append({'name':name, 'start':start - _origin, 'wall':wall, 'cpu':cpu, 'pid':os.getpid(), 'tid':threading.get_ident(), 'args':args})
+
+
+def instrument(name=None):
+    #decorator: record each call of a function as a span named after the function
+    def decorator(function):
+        span_name = name or function.__name__
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not ENABLED:
+                return function(*args, **kwargs)
+            with span(span_name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def count(name, n=1):
+    #add n items (e.g., measures, detections) to a counter
+    if not ENABLED:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + n
+
+
+def give_report():
+    #{'spans': {name: {'calls', 'wall', 'cpu', 'wall_max'}}, 'counters': {name: count}} in the order of the first call
+    spans = {}
+    with _lock:
+        for record in sorted(_spans, key=lambda record: record['start']):
+            summary = spans.setdefault(record['name'], {'calls':0, 'wall':0.0, 'cpu':0.0, 'wall_max':0.0})
+            summary['calls'] += 1
+            summary['wall'] += record['wall']
+            summary['cpu'] += record['cpu']
+            summary['wall_max'] = max(summary['wall_max'], record['wall'])
+        counters = dict(_counters)
+    return {'spans':spans, 'counters':counters}
+
+
+def write_report(REPORT_PATH, **extra):
+    #save give_report() (and extra items, e.g., the score) as JSON
+    report = dict(extra, **give_report())
+    os.makedirs(os.path.dirname(os.path.abspath(REPORT_PATH)), exist_ok=True)
+    with open(REPORT_PATH, 'w') as f:
+        json.dump(report, f, indent=1, ensure_ascii=False)
+    return report
+
+
+def write_chrome_trace(TRACE_PATH):
+    #save the spans in the Trace Event Format (complete events, in microseconds) and the counters as metadata
+    with _lock:
+        events = [{'name':record['name'], 'ph':'X', 'ts':record['start'] * 1e6, 'dur':record['wall'] * 1e6, 'pid':record['pid'], 'tid':record['tid'],
+            'args':dict(record['args'], cpu_ms=record['cpu'] * 1e3)} for record in _spans]
+        counters = dict(_counters)
+    os.makedirs(os.path.dirname(os.path.abspath(TRACE_PATH)), exist_ok=True)
+    with open(TRACE_PATH, 'w') as f:
+        json.dump({'traceEvents':events, 'displayTimeUnit':'ms', 'otherData':{'counters':counters}}, f)
@@ -7,9 +7,14 @@ import shutil
 import numpy as np
 import math
 import copy
+from concurrent.futures import ThreadPoolExecutor
+
+from instrumentation.instrumentation import instrument, count
 
 MIN_X_WIDTH = 300
 MIN_LINE_LENGTH = 100
+#measures are rotated only above this angle (degrees); the angles of measures come in steps of about 1 degree
+MEASURE_ANGLE_TOLERANCE = 0.5
 
 def rotate_image(image, angle):
   image_center = tuple(np.array(image.shape[1::-1]) / 2)
@@ -17,26 +22,67 @@ def rotate_image(image, angle):
   result = cv2.warpAffine(image, rot_mat, image.shape[1::-1], flags=cv2.INTER_LINEAR)
   return result
 
-def leveloriginalimg(FILE_PATH):
-    img = cv2.imread(FILE_PATH)
-    gray = cv2.cvtColor(img,cv2.COLOR_BGR2GRAY)
+#deskew of a page: the skew angle is estimated on a downscaled grayscale image
+#pyrDown the page until its width is at most DESKEW_MAX_WIDTH
+DESKEW_MAX_WIDTH = 1024
+#near-horizontal lines only (degrees); e.g., bar lines and stems are ignored
+MAX_SKEW_ANGLE = 20
+#the page is not rotated below this angle (degrees)
+LEVEL_ANGLE_TOLERANCE = 0.1
+#the projection profile is used if fewer near-horizontal lines are found
+MIN_SKEW_LINES = 5
+
+def giveDownscaledGray(img, max_width=DESKEW_MAX_WIDTH):
+    gray = cv2.cvtColor(img,cv2.COLOR_BGR2GRAY) if img.ndim == 3 else img
+    while gray.shape[1] > max_width:
+        gray = cv2.pyrDown(gray)
+    return gray
+
+def giveSkewAnglesByHough(gray):
+    #the angles (degrees) of the near-horizontal line segments (e.g., staff lines) found by the probabilistic Hough transform
+    #(the angles come from the end points of the segments, finer than the resolution of theta)
+    width = gray.shape[1]
     edges = cv2.Canny(gray,50,150,apertureSize = 3)
+    lines = cv2.HoughLinesP(edges, 1, np.pi/180, threshold=width//10, minLineLength=width//8, maxLineGap=width//100)
+    if lines is None:
+        return np.empty(0)
+    x1, y1, x2, y2 = lines[:, 0, :].T.astype(np.float64)
+    angles = np.degrees(np.arctan2(y2 - y1, x2 - x1))
+    #the direction of a segment does not matter: (-90, 90]
+    angles = (angles + 90) % 180 - 90
+    return angles[np.abs(angles) <= MAX_SKEW_ANGLE]
 
-    lines = cv2.HoughLines(edges,1,np.pi/180,200)
-    for rho,theta in lines[0]:
-        a = np.cos(theta)
-        b = np.sin(theta)
-        x0 = a*rho
-        y0 = b*rho
-        x1 = int(x0 + 1000*(-b))
-        y1 = int(y0 + 1000*(a))
-        x2 = int(x0 - 1000*(-b))
-        y2 = int(y0 - 1000*(a))
-
-        # cv2.line(img,(x1,y1),(x2,y2),(0,0,255),2)  
-    d_delta = math.degrees(math.atan((y2-y1)/(x2-x1)))
+def giveSkewAngleByProjection(gray, max_angle=MAX_SKEW_ANGLE):
+    #the angle (degrees) maximizing the variance of the horizontal projection profile (coarse to fine)
+    binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)[1]
+    def giveProfileVariance(angle):
+        return np.var(np.sum(rotate_image(binary, angle), axis=1, dtype=np.float64))
+    best_angle = max(np.arange(-max_angle, max_angle + 0.5, 0.5), key=giveProfileVariance)
+    best_angle = max(np.arange(best_angle - 0.5, best_angle + 0.55, 0.05), key=giveProfileVariance)
+    return float(best_angle)
+
+@instrument()
+def giveSkewAngle(img):
+    #the median of the angles of many lines, so that a single spurious line does not matter
+    gray = giveDownscaledGray(img)
+    angles = giveSkewAnglesByHough(gray)
+    if len(angles) >= MIN_SKEW_LINES:
+        return float(np.median(angles))
+    return giveSkewAngleByProjection(gray)
+
+@instrument()
+def levelpageimg(img, tolerance=LEVEL_ANGLE_TOLERANCE):
+    #level a page image in memory and return the leveled image (img itself below tolerance) and the angle
+    d_delta = giveSkewAngle(img)
+    if abs(d_delta) < tolerance:
+        return img, d_delta
+    return rotate_image(img, d_delta), d_delta
+
+@instrument()
+def leveloriginalimg(FILE_PATH):
+    img = cv2.imread(FILE_PATH)
+    image, d_delta = levelpageimg(img)
     print(d_delta)
-    image = rotate_image(img,d_delta)
     
     files_temp = glob.glob(FILE_PATH) #"./tmp/*":beforehand prepare images and Yolov5 anotation files in ./tmp/subdirectory
     #To skip .txt files
@@ -50,42 +96,76 @@ def leveloriginalimg(FILE_PATH):
             FILE_BASENAME_WITHOUTEXT = os.path.splitext(FILE_BASENAME)[0]
             FILE_EXT = os.path.splitext(FILE_BASENAME)[1].lower()
             LEVELED_FILE_PATH = FILE_DIR_PATH + '/leveled_' + FILE_BASENAME_WITHOUTEXT + FILE_EXT
-            cv2.imwrite(LEVELED_FILE_PATH, image)
+            if image is img:
+                #not rotated: the original file as it is (no re-encoding)
+                shutil.copyfile(file_temp, LEVELED_FILE_PATH)
+            else:
+                cv2.imwrite(LEVELED_FILE_PATH, image)
     return LEVELED_FILE_PATH
 
-def leveleachmeasure(FILE_PATH):
-    img = cv2.imread(FILE_PATH)
-    gray = cv2.cvtColor(img,cv2.COLOR_BGR2GRAY)
+def giveMeasureAngle(img):
+    #the angle (degrees) of the first long line (e.g., a staff line) found by HoughLines in a measure image
+    #0.0 (left as it is) if no such line is found
+    gray = cv2.cvtColor(img,cv2.COLOR_BGR2GRAY) if img.ndim == 3 else img
     edges = cv2.Canny(gray,50,150,apertureSize = 3)
 
     lines = cv2.HoughLines(edges,1,np.pi/180, MIN_LINE_LENGTH)
-    lines_coord = []
-    for line in lines:
-        for rho,theta in line:
-            a = np.cos(theta)
-            b = np.sin(theta)
-            x0 = a*rho
-            y0 = b*rho
-            x1 = int(x0 + 1000*(-b))
-            y1 = int(y0 + 1000*(a))
-            x2 = int(x0 - 1000*(-b))
-            y2 = int(y0 - 1000*(a))
-
-            if x2 - x1 < MIN_X_WIDTH:
-                continue
-
-            # cv2.line(img,(x1,y1),(x2,y2),(0,0,255),2)
-            lines_coord.append((x1, y1, x2, y2))
-        
-    # plt.imshow(img)
-    # f_out = 'out_' + filename
-    # cv2.imwrite(f_out, img)
-
-    (x1, y1, x2, y2) = lines_coord[0]
-    d_delta = math.degrees(math.atan((y2-y1)/(x2-x1)))
+    if lines is None:
+        return 0.0
+    rho, theta = lines[:, 0, 0], lines[:, 0, 1]
+    a = np.cos(theta)
+    b = np.sin(theta)
+    x0 = a*rho
+    y0 = b*rho
+    x1 = (x0 + 1000*(-b)).astype(int)
+    y1 = (y0 + 1000*(a)).astype(int)
+    x2 = (x0 - 1000*(-b)).astype(int)
+    y2 = (y0 - 1000*(a)).astype(int)
+    #the first line wider than MIN_X_WIDTH
+    wide = np.flatnonzero(x2 - x1 >= MIN_X_WIDTH)
+    if len(wide) == 0:
+        return 0.0
+    k = wide[0]
+    return math.degrees(math.atan((y2[k]-y1[k])/(x2[k]-x1[k])))
 
+@instrument()
+def levelmeasureimg(img):
+    #level a measure image in memory and return the leveled image and the angle
+    d_delta = giveMeasureAngle(img)
     out_image = rotate_image(img, d_delta) 
+    return out_image, d_delta
+
+def leveleachmeasure(FILE_PATH):
+    img = cv2.imread(FILE_PATH)
+    out_image, d_delta = levelmeasureimg(img)
     cv2.imwrite(FILE_PATH, out_image)
 
     return d_delta
 
+@instrument()
+def giveMeasureAngles(measure_stack, max_workers=None):
+    #the angles of all measure images at once in a thread pool (OpenCV releases the GIL)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return np.array(list(executor.map(giveMeasureAngle, measure_stack)), dtype=np.float64).reshape(-1)
+
+@instrument()
+def levelmeasurestack(measure_stack, tolerance=MEASURE_ANGLE_TOLERANCE, max_workers=None):
+    #level a stack of measure images (N, H, W) or (N, H, W, 3) in place and return it with the angles
+    #only the measures tilted by tolerance or more are rotated
+    d_deltas = giveMeasureAngles(measure_stack, max_workers=max_workers)
+    for k in np.flatnonzero(np.abs(d_deltas) >= tolerance):
+        measure_stack[k] = rotate_image(measure_stack[k], d_deltas[k])
+    count('measures leveled', len(d_deltas))
+    count('measures rotated', int(np.count_nonzero(np.abs(d_deltas) >= tolerance)))
+    return measure_stack, d_deltas
+
+def levelmeasureimages(measure_images, tolerance=MEASURE_ANGLE_TOLERANCE, max_workers=None):
+    #level each measure image in measure_images = {'measure#000':img, ...} in place (the tilted images are replaced, not overwritten)
+    names = list(measure_images.keys())
+    d_deltas = giveMeasureAngles([measure_images[nameOfMeasure] for nameOfMeasure in names], max_workers=max_workers)
+    for nameOfMeasure, d_delta in zip(names, d_deltas):
+        if abs(d_delta) >= tolerance:
+            measure_images[nameOfMeasure] = rotate_image(measure_images[nameOfMeasure], d_delta)
+    count('measures leveled', len(measure_images))
+    count('measures rotated', int(np.count_nonzero(np.abs(d_deltas) >= tolerance)))
+    return measure_images
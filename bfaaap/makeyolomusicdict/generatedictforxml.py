@@ -6,12 +6,18 @@
 import cv2
 import glob
 import os
+import re
 import shutil
 import numpy as np
 import math
-from enum import Enum, auto
+from enum import Enum, IntEnum, auto
 import copy
+import bisect
 from itertools import chain
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from instrumentation.instrumentation import instrument, count
 
 # Scale definition
 """
@@ -25,11 +31,6 @@ class Clef(Enum):
     F8vb = auto()
     none = auto()
 
-    def __eq__(self, other):
-        if self.name == other.name:
-            return True
-        return False
-
 
 """#label#
 body: bd0 (black), bd1 (black dot), bd2 (white), bd3 (white dot), bd4 (large white), bd5 (large white dot)
@@ -38,7 +39,7 @@ accidental: ac0 (#), ac1 (b), ac2 (natural)
 rest: re0 (whole), re1 (half), re2 (quarter), re3 (eighth), re4 (16th)
 clef: cf0 (clef G), cf1 (clef F), cf2 (clef 8 (8va or 8vb), cf3 (clef 8va_stop), cf4( 8vb_stop):attention! changed
 """
-class Category(Enum):
+class Category(IntEnum):
     bd0 = auto()
     bd1 = auto()
     bd2 = auto()
@@ -68,10 +69,43 @@ class Category(Enum):
     cf4 = auto()
     none = auto()
 
-    def __eq__(self, other):
-        if self.name == other.name:
-            return True
-        return False
+    #printed as Category.bd0 (not as the integer code)
+    __str__ = Enum.__str__
+
+#each group of categories as a bitmask (the bit 1 << category is set for its members),
+#so that whether an ms item belongs to a group is checked by one bitwise and (see isBody, isRest, ...)
+def giveCategoryMask(*categories):
+    mask = 0
+    for category in categories:
+        mask |= 1 << category
+    return mask
+
+STICKED_BODY_MASK = giveCategoryMask(Category.bd0, Category.bd1, Category.bd2, Category.bd3)
+UNSTICKED_BODY_MASK = giveCategoryMask(Category.bd4, Category.bd5)
+BODY_MASK = STICKED_BODY_MASK | UNSTICKED_BODY_MASK
+ARM_MASK = giveCategoryMask(Category.am0, Category.am1, Category.am2, Category.am3)
+BEAM_MASK = giveCategoryMask(Category.bm0, Category.bm1, Category.bm2, Category.bm3)
+ARM_OR_BEAM_MASK = ARM_MASK | BEAM_MASK
+ACCIDENTAL_MASK = giveCategoryMask(Category.ac0, Category.ac1, Category.ac2)
+REST_MASK = giveCategoryMask(Category.re0, Category.re1, Category.re2, Category.re3, Category.re4)
+CLEF_MASK = giveCategoryMask(Category.cf0, Category.cf1, Category.cf2, Category.cf3, Category.cf4)
+
+#the categories of each Yolov5 model in the order of its class indices (class index i in a label file -> categories[i])
+CATEGORIES_OF_EACHMODEL = {
+    'body':(Category.bd0, Category.bd1, Category.bd2, Category.bd3, Category.bd4, Category.bd5),
+    'armbeam':(Category.am0, Category.am1, Category.am2, Category.am3, Category.bm0, Category.bm1, Category.bm2, Category.bm3),
+    'rest':(Category.re0, Category.re1, Category.re2, Category.re3, Category.re4),
+    'accidental':(Category.ac0, Category.ac1, Category.ac2),
+    'clef':(Category.cf0, Category.cf1, Category.cf2, Category.cf3, Category.cf4),
+}
+
+def giveCategoryFromClassIndex(model, class_index):
+    #e.g., ('armbeam', '4') -> Category.bm0; an unknown class index -> Category.none
+    categories = CATEGORIES_OF_EACHMODEL[model]
+    class_index = int(class_index)
+    if 0 <= class_index < len(categories):
+        return categories[class_index]
+    return Category.none
 
 class MeasureType(Enum):
     x0 = auto()
@@ -79,16 +113,66 @@ class MeasureType(Enum):
     y0 = auto()
     none = auto()
 
-    def __eq__(self, other):
-        if self.name == other.name:
-            return True
-        return False
-
 
 # Musical symbol anotation
-musicalSymbol_template = {'measuretype':MeasureType.none, 'category':Category.none, 'x':0., 'y':0., 'w':0., 'h':0., 'alpha':0., 'beta':0.,
-    'step':'', 'alter':'', 'octave':'', 'duration':0, 'voice':1, 'type':'', 'dot':False, 'stem':'', 'staff':1,
-    'beam_number':0, 'beam_content':'', 'chord':False, 'rest':False, 'clef':Clef.none, 'fifths':0, 'octave_shift':'', 'clefchange':False}
+class MusicalSymbol:
+    #a musical symbol (ms) item with the same fields as the former musicalSymbol_template dictionary
+    #fields are read and written as ms['y'] (or ms.y); __slots__ keeps each item small and the field access cheap
+    #ms items are compared by identity (no __eq__), so that `ms in ms_list` and ms_list.remove(ms) find that very item
+    __slots__ = ('measuretype', 'category', 'x', 'y', 'w', 'h', 'alpha', 'beta',
+        'step', 'alter', 'octave', 'duration', 'voice', 'type', 'dot', 'stem', 'staff',
+        'beam_number', 'beam_content', 'chord', 'rest', 'clef', 'fifths', 'octave_shift', 'clefchange')
+    _defaults = (MeasureType.none, Category.none, 0., 0., 0., 0., 0., 0.,
+        '', '', '', 0, 1, '', False, '', 1,
+        0, '', False, False, Clef.none, 0, '', False)
+
+    def __init__(self, **fields):
+        for field, default in zip(self.__slots__, self._defaults):
+            setattr(self, field, default)
+        for field, value in fields.items():
+            setattr(self, field, value)
+
+    def __getitem__(self, field):
+        return getattr(self, field)
+
+    def __setitem__(self, field, value):
+        setattr(self, field, value)
+
+    def __copy__(self):
+        ms = MusicalSymbol.__new__(MusicalSymbol)
+        for field in self.__slots__:
+            setattr(ms, field, getattr(self, field))
+        return ms
+
+    def __getstate__(self):
+        return tuple(getattr(self, field) for field in self.__slots__)
+
+    def __setstate__(self, state):
+        for field, value in zip(self.__slots__, state):
+            setattr(self, field, value)
+
+    def keys(self):
+        return list(self.__slots__)
+
+    def __iter__(self):
+        #the field names, as iterating a dictionary
+        return iter(self.__slots__)
+
+    def items(self):
+        return [(field, getattr(self, field)) for field in self.__slots__]
+
+    def get(self, field, default=None):
+        return getattr(self, field, default)
+
+    def __contains__(self, field):
+        return field in self.__slots__
+
+    def __repr__(self):
+        return 'MusicalSymbol(' + ', '.join(f'{field}={getattr(self, field)!r}' for field in self.__slots__) + ')'
+
+
+#an empty ms item (the dummy first item of each measure)
+musicalSymbol_template = MusicalSymbol()
 
 
 #set the clef positions
@@ -117,6 +201,42 @@ def set_staffmiddle_heightInterval_for_notePosition(alpha, beta):
     }
     return staffmiddle, heightInterval, notePositionInClef_G, notePositionInClef_F, notePositionInClef_G8va, notePositionInClef_F8vb
 
+#pitch without the position tables above: the step (half line spacing) k below the middle line satisfies
+#staffmiddle + heightInterval*(k - 0.5) < y <= staffmiddle + heightInterval*(k + 0.5), i.e., k = ceil((y - staffmiddle)/heightInterval - 0.5)
+#and the note index (octave*7 + C:0, D:1, ..., B:6) is that of the middle line minus k
+STEPS = 'CDEFGAB'
+MIDDLE_LINE_NOTE_INDEX = {Clef.G:4*7 + 6, Clef.F:3*7 + 1, Clef.G8va:5*7 + 6, Clef.F8vb:2*7 + 1}#B4, D3, B5, D2
+#notes are identified up to this number of steps above and below the middle line (the range of the position tables)
+MAX_STAFF_STEP = 12
+
+def giveStaffmiddleHeightInterval(alpha, beta):
+    staffmiddle = 0.5 + alpha
+    heightInterval =  1.0/(8 +2*(8*1.2)) + beta
+    return staffmiddle, heightInterval
+
+def giveStaffStep(y, staffmiddle, heightInterval, max_step=MAX_STAFF_STEP):
+    #return k (positive: below the middle line) or None if y is out of the steps -max_step to max_step
+    if heightInterval <= 0:
+        return None
+    k_estimate = math.ceil((y - staffmiddle)/heightInterval - 0.5)
+    #the neighbours are checked with the same comparison as the position tables, so that y on a boundary gives the same note
+    for k in (k_estimate - 1, k_estimate, k_estimate + 1):
+        if -max_step <= k <= max_step:
+            middleheight = staffmiddle + heightInterval*k
+            if ((middleheight - heightInterval*0.5) < y) and (y <= (middleheight + heightInterval*0.5)):
+                return k
+    return None
+
+def givePitch(y, clef, staffmiddle, heightInterval, max_step=MAX_STAFF_STEP):
+    #return (step, octave) such as ('B', '4') for y in the clef, or None
+    if clef not in MIDDLE_LINE_NOTE_INDEX:
+        return None
+    k = giveStaffStep(y, staffmiddle, heightInterval, max_step)
+    if k is None:
+        return None
+    note_index = MIDDLE_LINE_NOTE_INDEX[clef] - k
+    return STEPS[note_index % 7], str(note_index // 7)
+
 # To determine the positional relationship between musical symbols
 
 def isHorizontallyOverlapping(ms1, ms2):
@@ -168,8 +288,68 @@ def ms_verticallysorting(ms_group):
     #ms_group should contain multiple mucicalSymbols to be sorted in the x direction
     return sorted(ms_group, key=lambda x: x['y'], reverse=True)
 
+#an index of the ms items in a measure sorted by the left ends of their x-extents
+#an ms item overlaps the x-extent [left, right] of the msOfInterest only if its left end is in [left - the maximum width, right],
+#so that the ms items to be checked are found by bisection instead of scanning the whole measure
+class MusicalSymbolIndex:
+    #margin for the rounding errors of x - w*0.5 and x + w*0.5
+    MARGIN = 1e-9
+
+    def __init__(self, ms_all):
+        self.ms_all = list(ms_all)
+        #{id(ms): (left, order)}; order is the position in ms_all to keep the order of the ms items in ties
+        self.keys = {}
+        self.lefts = []
+        self.entries = []
+        self.max_width = 0.
+        entries = []
+        for order, ms in enumerate(self.ms_all):
+            key = (ms['x'] - ms['w']*0.5, order)
+            self.keys[id(ms)] = key
+            entries.append((key, ms))
+            self.max_width = max(self.max_width, ms['w'])
+        entries.sort(key=lambda entry: entry[0])
+        self.lefts = [key for key, ms in entries]
+        self.entries = [ms for key, ms in entries]
+
+    def update(self, ms):
+        #call after changing ms['x'] or ms['w'] of an ms item in the index
+        old_key = self.keys[id(ms)]
+        i = bisect.bisect_left(self.lefts, old_key)
+        del self.lefts[i]
+        del self.entries[i]
+        key = (ms['x'] - ms['w']*0.5, old_key[1])
+        i = bisect.bisect_left(self.lefts, key)
+        self.lefts.insert(i, key)
+        self.entries.insert(i, ms)
+        self.keys[id(ms)] = key
+        self.max_width = max(self.max_width, ms['w'])
+
+    def giveCandidates(self, msOfInterest):
+        #ms items which may overlap the x-extent of msOfInterest (a superset of the overlapping ones)
+        left = msOfInterest['x'] - msOfInterest['w']*0.5 - self.max_width - self.MARGIN
+        right = msOfInterest['x'] + msOfInterest['w']*0.5 + self.MARGIN
+        start = bisect.bisect_left(self.lefts, (left, -1))
+        end = bisect.bisect_right(self.lefts, (right, len(self.ms_all)))
+        return [(self.lefts[i][1], self.entries[i]) for i in range(start, end)]
+
+    def giveVerticallyOverlappingDescending(self, msOfInterest):
+        #same as collectVerticallyOverlappingDescendingMusicalSymbols(ms_all, msOfInterest): in the descending order of y
+        hits = [(-ms['y'], order, ms) for order, ms in self.giveCandidates(msOfInterest) if isVerticallyOverlapping(msOfInterest, ms)]
+        hits.sort(key=lambda hit: hit[:2])
+        return [ms for minus_y, order, ms in hits]
+
+    def giveContacting(self, msOfInterest):
+        #same as collectContactingMusicalSymbols(ms_all, msOfInterest): in the order of ms_all
+        hits = [(order, ms) for order, ms in self.giveCandidates(msOfInterest) if isContacting(ms, msOfInterest)]
+        hits.sort(key=lambda hit: hit[0])
+        return [ms for order, ms in hits]
+
 #collect ms items in contact with ms1: (ms: musical symboles)
 def collectContactingMusicalSymbols(ms_all, msOfInterest):
+    #ms_all: a list of ms items or a MusicalSymbolIndex
+    if isinstance(ms_all, MusicalSymbolIndex):
+        return ms_all.giveContacting(msOfInterest)
     ms_group = []
     for each_ms in ms_all:
         if isContacting(each_ms, msOfInterest):
@@ -178,6 +358,9 @@ def collectContactingMusicalSymbols(ms_all, msOfInterest):
 
 #collect vertically overlapping ms items in an ms group
 def collectVerticallyOverlappingDescendingMusicalSymbols(ms_all, msOfInterest):
+    #ms_all: a list of ms items or a MusicalSymbolIndex
+    if isinstance(ms_all, MusicalSymbolIndex):
+        return ms_all.giveVerticallyOverlappingDescending(msOfInterest)
     verticallyOverlappingDescendingMSGroup = []
     for eachms in ms_all:
         if isVerticallyOverlapping(msOfInterest, eachms):
@@ -295,133 +478,30 @@ def changeAccidentalTable(current_accidental_table_input, ms1, clef_temp, alpha,
     ms1['clef'] = clef_temp
     
     #set clef position with alpha and beta
-    staffmiddle, heightInterval, notePositionInClef_G, notePositionInClef_F, notePositionInClef_G8va, notePositionInClef_F8vb = set_staffmiddle_heightInterval_for_notePosition(alpha, beta)
-    if ms1['clef'] == Clef.G:
-        # print(f'clefは{Clef.G}')
-        noteFlag = False
-        for note, middleheight in notePositionInClef_G.items():
-            # the case depends on the category
-            if ms1["category"] == Category.ac0:
-                if ((middleheight - heightInterval*0.5) < ms1["y"]) and (ms1["y"] <= (middleheight + heightInterval*0.5)):
-                    noteFlag = True
-                    pitchClass = note[0]
-                    #add the accidental to ms1
-                    current_accidental_table[pitchClass] = '#'
-            elif ms1["category"] == Category.ac1:
-                #judge the bottom(ms1["y"] + ms1["h"]*0.5) - heightInterval as the b position
-                # print(f'middleheight - heightInterval*0.5  is {middleheight - heightInterval*0.5}')
-                # print(f'(ms1["y"] + ms1["h"]*0.5 - heightInterval) is {(ms1["y"] + ms1["h"]*0.5 - heightInterval)}')
-                if ((middleheight - heightInterval*0.5) < (ms1["y"] + ms1["h"]*0.5 - heightInterval - 0.01)) and ((ms1["y"] + ms1["h"]*0.5 - heightInterval -0.01) <= (middleheight + heightInterval*0.5)):
-                    noteFlag = True
-                    pitchClass = note[0]
-                    print(f'pitchClass changed is {pitchClass}')
-                    #add the accidental to ms1
-                    current_accidental_table[pitchClass] = 'b'
-            elif ms1["category"] == Category.ac2:
-                 if ((middleheight - heightInterval*0.5) < ms1["y"]) and (ms1["y"] <= (middleheight + heightInterval*0.5)):
-                    noteFlag = True
-                    pitchClass = note[0]
-                    #add the accidental to ms1
-                    current_accidental_table[pitchClass] = ''
-            else:
-                print('there is no accidental')
-        return current_accidental_table
-        if noteFlag == False:
-            return current_accidental_table
-    elif ms1['clef'] == Clef.G8va:
-        noteFlag = False
-        for note, middleheight in notePositionInClef_G8va.items():
-            # the case depends on the category
-            if ms1["category"] == Category.ac0:
-                if ((middleheight - heightInterval*0.5) < ms1["y"]) and (ms1["y"] <= (middleheight + heightInterval*0.5)):
-                    noteFlag = True
-                    pitchClass = note[0]
-                    #add the accidental to ms1
-                    current_accidental_table[pitchClass] = '#'
-            elif ms1["category"] == Category.ac1:
-                #judge the bottom(ms1["y"] + ms1["h"]*0.5) - heightInterval as the b position
-                # print(f'middleheight - heightInterval*0.5  is {middleheight - heightInterval*0.5}')
-                # print(f'(ms1["y"] + ms1["h"]*0.5 - heightInterval) is {(ms1["y"] + ms1["h"]*0.5 - heightInterval)}')
-                if ((middleheight - heightInterval*0.5) < (ms1["y"] + ms1["h"]*0.5 - heightInterval - 0.01)) and ((ms1["y"] + ms1["h"]*0.5 - heightInterval - 0.01) <= (middleheight + heightInterval*0.5)):
-                    pitchClass = note[0]
-                    print(f'変更されるpitchClassは{pitchClass}')
-                    #add the accidental to ms1
-                    current_accidental_table[pitchClass] = 'b'
-            elif ms1["category"] == Category.ac2:
-                 if ((middleheight - heightInterval*0.5) < ms1["y"]) and (ms1["y"] <= (middleheight + heightInterval*0.5)):
-                    noteFlag = True
-                    pitchClass = note[0]
-                    #add the accidental to ms1
-                    current_accidental_table[pitchClass] = ''
-            else:
-                print('there is no accidental')
-        return current_accidental_table
-        if noteFlag == False:
-            return current_accidental_table
-    elif ms1['clef'] == Clef.F:
-        noteFlag = False
-        for note, middleheight in notePositionInClef_F.items():
-            # the case depends on the category
-            if ms1["category"] == Category.ac0:
-                if ((middleheight - heightInterval*0.5) < ms1["y"]) and (ms1["y"] <= (middleheight + heightInterval*0.5)):
-                    noteFlag = True
-                    pitchClass = note[0]
-                    #add the accidental to ms1
-                    current_accidental_table[pitchClass] = '#'
-            elif ms1["category"] == Category.ac1:
-                #judge the bottom(ms1["y"] + ms1["h"]*0.5) - heightInterval as the b position
-                # print(f'middleheight - heightInterval*0.5  is {middleheight - heightInterval*0.5}')
-                # print(f'(ms1["y"] + ms1["h"]*0.5 - heightInterval) is {(ms1["y"] + ms1["h"]*0.5 - heightInterval)}')
-                if ((middleheight - heightInterval*0.5) < (ms1["y"] + ms1["h"]*0.5 - heightInterval - 0.01)) and ((ms1["y"] + ms1["h"]*0.5 - heightInterval - 0.01) <= (middleheight + heightInterval*0.5)):
-                    noteFlag = True
-                    pitchClass = note[0]
-                    print(f'pitchClass changed is {pitchClass}')
-                    #add the accidental to ms1
-                    current_accidental_table[pitchClass] = 'b'
-            elif ms1["category"] == Category.ac2:
-                 if ((middleheight - heightInterval*0.5) < ms1["y"]) and (ms1["y"] <= (middleheight + heightInterval*0.5)):
-                    noteFlag = True
-                    pitchClass = note[0]
-                    #add the accidental to ms1
-                    current_accidental_table[pitchClass] = ''
-            else:
-                print('there is no accidental')
-        return current_accidental_table
-        if noteFlag == False:
-            return current_accidental_table
-    elif ms1['clef'] == Clef.F8vb:
-        noteFlag = False
-        for note, middleheight in notePositionInClef_F8vb.items():
-            # the case depends on the category
-            if ms1["category"] == Category.ac0:
-                if ((middleheight - heightInterval*0.5) < ms1["y"]) and (ms1["y"] <= (middleheight + heightInterval*0.5)):
-                    noteFlag = True
-                    pitchClass = note[0]
-                    #add the accidental to ms1
-                    current_accidental_table[pitchClass] = '#'
-            elif ms1["category"] == Category.ac1:
-                #judge the bottom(ms1["y"] + ms1["h"]*0.5) - heightInterval as the b position
-                # print(f'middleheight - heightInterval*0.5  is {middleheight - heightInterval*0.5}')
-                # print(f'(ms1["y"] + ms1["h"]*0.5 - heightInterval) is {(ms1["y"] + ms1["h"]*0.5 - heightInterval)}')
-                if ((middleheight - heightInterval*0.5) < (ms1["y"] + ms1["h"]*0.5 - heightInterval - 0.01)) and ((ms1["y"] + ms1["h"]*0.5 - heightInterval - 0.01) <= (middleheight + heightInterval*0.5)):
-                    noteFlag = True
-                    pitchClass = note[0]
-                    print(f'pitchClass changed is {pitchClass}')
-                    #add the accidental to ms1
-                    current_accidental_table[pitchClass] = 'b'
-            elif ms1["category"] == Category.ac2:
-                 if ((middleheight - heightInterval*0.5) < ms1["y"]) and (ms1["y"] <= (middleheight + heightInterval*0.5)):
-                    noteFlag = True
-                    pitchClass = note[0]
-                    #add the accidental to ms1
-                    current_accidental_table[pitchClass] = ''
-            else:
-                print('there is no accidental')
-        return current_accidental_table
-        if noteFlag == False:
-            return current_accidental_table
+    staffmiddle, heightInterval = giveStaffmiddleHeightInterval(alpha, beta)
+    if ms1["category"] == Category.ac0:
+        pitch = givePitch(ms1["y"], ms1['clef'], staffmiddle, heightInterval)
+        if pitch is not None:
+            pitchClass = pitch[0]
+            #add the accidental to ms1
+            current_accidental_table[pitchClass] = '#'
+    elif ms1["category"] == Category.ac1:
+        #judge the bottom(ms1["y"] + ms1["h"]*0.5) - heightInterval as the b position
+        pitch = givePitch(ms1["y"] + ms1["h"]*0.5 - heightInterval - 0.01, ms1['clef'], staffmiddle, heightInterval)
+        if pitch is not None:
+            pitchClass = pitch[0]
+            print(f'pitchClass changed is {pitchClass}')
+            #add the accidental to ms1
+            current_accidental_table[pitchClass] = 'b'
+    elif ms1["category"] == Category.ac2:
+        pitch = givePitch(ms1["y"], ms1['clef'], staffmiddle, heightInterval)
+        if pitch is not None:
+            pitchClass = pitch[0]
+            #add the accidental to ms1
+            current_accidental_table[pitchClass] = ''
     else:
-        return current_accidental_table
+        print('there is no accidental')
+    return current_accidental_table
 
 
 
@@ -477,35 +557,14 @@ bd1 (+ dot):
 #identify note (step, octave, alter) of ms of interest
 def identifyNoteFromMS(msOfInterest, current_accidental_table_input, clef_input, alpha, beta):
     #set clef position with alpha and beta
-    staffmiddle, heightInterval, notePositionInClef_G, notePositionInClef_F, notePositionInClef_G8va, notePositionInClef_F8vb = set_staffmiddle_heightInterval_for_notePosition(alpha, beta)
+    staffmiddle, heightInterval = giveStaffmiddleHeightInterval(alpha, beta)
 
-    #extract each combination of note and middle height and compare the height to that of msOfInterest
-    #then assign the msOfInterest to the corresponding note
-    
+    #the note at the height of msOfInterest
     note_candidate = ''
-    if clef_input == Clef.G:
-        for note, middleheight in notePositionInClef_G.items():
-            if ((middleheight - heightInterval*0.5) < msOfInterest["y"]) and (msOfInterest["y"] <= (middleheight + heightInterval*0.5)):
-                note_candidate = note
-            else:
-                pass
-                # print(f'compare：middleheight - heightInterval*0.5：{middleheight - heightInterval*0.5},msOfInterest["y"]:{msOfInterest["y"]},middleheight + heightInterval*0.5:{middleheight + heightInterval*0.5}')
-    elif clef_input == Clef.F:
-        for note, middleheight in notePositionInClef_F.items():
-            if ((middleheight - heightInterval*0.5) < msOfInterest["y"]) and (msOfInterest["y"] <= (middleheight + heightInterval*0.5)):
-                note_candidate = note
-            else:
-                pass
-                # print(f'compare：middleheight - heightInterval*0.5：{middleheight - heightInterval*0.5},msOfInterest["y"]:{msOfInterest["y"]},middleheight + heightInterval*0.5:{middleheight + heightInterval*0.5}')
-
-    elif clef_input == Clef.G8va:
-        for note, middleheight in notePositionInClef_G8va.items():
-            if ((middleheight - heightInterval*0.5) < msOfInterest["y"]) and (msOfInterest["y"] <= (middleheight + heightInterval*0.5)):
-                note_candidate = note
-    elif clef_input == Clef.F8vb:
-        for note, middleheight in notePositionInClef_F8vb.items():
-            if ((middleheight - heightInterval*0.5) < msOfInterest["y"]) and (msOfInterest["y"] <= (middleheight + heightInterval*0.5)):
-                note_candidate = note
+    if clef_input in MIDDLE_LINE_NOTE_INDEX:
+        pitch = givePitch(msOfInterest["y"], clef_input, staffmiddle, heightInterval)
+        if pitch is not None:
+            note_candidate = pitch
     else:
         print('no clef is found in NoteIdentifycation')
     #identify the octave, step
@@ -539,51 +598,24 @@ def areTopMSandBottomMSDifferentArmBeams(topMS_input, bottomMS_input):#return Tr
 
 #check which class the msOfInterest belongs to?
 def isRest(msOfInterest):
-    if msOfInterest['category'] == Category.re0 or msOfInterest['category'] == Category.re1 or msOfInterest['category'] == Category.re2 or msOfInterest['category'] == Category.re3 or msOfInterest['category'] == Category.re4:
-        return True
-    else:
-        return False
+    return (1 << msOfInterest['category']) & REST_MASK != 0
 def isAccidental(msOfInterest):
-    if msOfInterest['category'] == Category.ac0 or msOfInterest['category'] == Category.ac1 or msOfInterest['category'] == Category.ac2:
-        return True
-    else:
-        return False
+    return (1 << msOfInterest['category']) & ACCIDENTAL_MASK != 0
 def isClef(msOfInterest):
-    if msOfInterest['category'] == Category.cf0 or msOfInterest['category'] == Category.cf1 or msOfInterest['category'] == Category.cf2 or msOfInterest['category'] == Category.cf3 or msOfInterest['category'] == Category.cf4:
-        return True
-    else:
-        return False
+    return (1 << msOfInterest['category']) & CLEF_MASK != 0
 def isArm(msOfInterest):
-    if msOfInterest['category'] == Category.am0 or msOfInterest['category'] == Category.am1 or msOfInterest['category'] == Category.am2 or msOfInterest['category'] == Category.am3:
-        return True
-    else:
-        return False
+    return (1 << msOfInterest['category']) & ARM_MASK != 0
 def isBeam(msOfInterest):
-    if msOfInterest['category'] == Category.bm0 or msOfInterest['category'] == Category.bm1 or msOfInterest['category'] == Category.bm2 or msOfInterest['category'] == Category.bm3:
-        return True
-    else:
-        return False
+    return (1 << msOfInterest['category']) & BEAM_MASK != 0
 def isArmOrBeam(msOfInterest):
-    if isArm(msOfInterest) or isBeam(msOfInterest):
-        return True
-    else:
-        return False
+    return (1 << msOfInterest['category']) & ARM_OR_BEAM_MASK != 0
 
 def isStickedBody(msOfInterest):
-    if msOfInterest['category'] == Category.bd0 or msOfInterest['category'] == Category.bd1 or msOfInterest['category'] == Category.bd2 or msOfInterest['category'] == Category.bd3:
-        return True
-    else:
-        return False
+    return (1 << msOfInterest['category']) & STICKED_BODY_MASK != 0
 def isUnstickedBody(msOfInterest):
-    if msOfInterest['category'] == Category.bd4 or msOfInterest['category'] == Category.bd5:
-        return True
-    else:
-        return False
+    return (1 << msOfInterest['category']) & UNSTICKED_BODY_MASK != 0
 def isBody(msOfInterest):
-    if isStickedBody(msOfInterest) or isUnstickedBody(msOfInterest):
-        return True
-    else:
-        return False
+    return (1 << msOfInterest['category']) & BODY_MASK != 0
 
 def closerToLower(msOfInterest, ms_lower, ms_upper):
     if abs(msOfInterest['y'] - ms_upper['y']) > abs(msOfInterest['y'] - ms_lower['y']):
@@ -1224,8 +1256,11 @@ def giveChordAccordingly(vodMS):
     
 
 #annotate each ms item in the horizontallysortedMSlist as an input
+@instrument()
 def annotateEachMS(horizontallysortedMSlist_input, current_accidental_table_input, staff_input, clef_input, preset_measure_duration, alpha, beta):
     horizontallysortedMSlist = copy.copy(horizontallysortedMSlist_input)
+    #for vertically overlapping ms items
+    ms_index = MusicalSymbolIndex(horizontallysortedMSlist)
     accidental_table = copy.copy(current_accidental_table_input)
     staff_temp = copy.copy(staff_input)
     clef_temp =  copy.copy(clef_input)
@@ -1247,7 +1282,8 @@ def annotateEachMS(horizontallysortedMSlist_input, current_accidental_table_inpu
     postbody_intermediate_rest = []
     #analyzed body and associated arm items and top and bottom rest ms items are excluded to avoid repeated analysis
     #beam ms item should be reused, so that ms_body_rest_items_excluded should not contain any beam item
-    ms_body_arm_rest_items_excluded = []#e.g., [[ms_rest0],vodMS_0,vodMS_1,[ms_restt1]];vodMS as a list of ms items; each ms is a dictionary
+    #kept as a set of id(ms), so that whether a body has been analyzed is checked without flattening all the excluded vodMS items
+    ms_body_arm_rest_items_excluded = set()#e.g., {id(ms_rest0), id(each ms in vodMS_0), ...}
     #all vodMS and [rest] are stored for voice adjustmet later
     all_vodMS_rest_items = []#e.g., [[ms_rest0],vodMS_0,vodMS_1,[ms_cf2], vodMS_2, [ms_restt1]];
 
@@ -1287,7 +1323,7 @@ def annotateEachMS(horizontallysortedMSlist_input, current_accidental_table_inpu
                         # clefchangeFlag = True
             if eachms["category"] == Category.cf2:
                 #temporarily disabled
-                ms_body_arm_rest_items_excluded.append(eachms)
+                ms_body_arm_rest_items_excluded.add(id(eachms))
                 # if eachms['y'] < 0.2:
                 #     eachms['octave_shift'] = 'down'
                 #     eachms['clef'] = Clef.G8va
@@ -1302,7 +1338,7 @@ def annotateEachMS(horizontallysortedMSlist_input, current_accidental_table_inpu
                 #     print('octave_shift:upです。')
             elif eachms["category"] == Category.cf3:
                 #temporarily disabled
-                ms_body_arm_rest_items_excluded.append(eachms)
+                ms_body_arm_rest_items_excluded.add(id(eachms))
                 # if eachms['y'] < 0.2:
                 #     if clef_temp == Clef.G8va:
                 #         eachms['octave_shift'] = 'stop'
@@ -1312,7 +1348,7 @@ def annotateEachMS(horizontallysortedMSlist_input, current_accidental_table_inpu
                 #         print('octave_shift:stopです。')
             elif eachms["category"] == Category.cf4:
                 #temporarily disabled
-                ms_body_arm_rest_items_excluded.append(eachms)
+                ms_body_arm_rest_items_excluded.add(id(eachms))
                 # if eachms['y'] > 0.8:
                 #     if clef_temp == Clef.F8vb:
                 #         eachms['octave_shift'] = 'stop'
@@ -1333,10 +1369,8 @@ def annotateEachMS(horizontallysortedMSlist_input, current_accidental_table_inpu
             #empty pre- and post-body rest list
             prebody_intermediate_rest = []
             postbody_intermediate_rest = []
-            #to avoid repeated analysis; first flatten a list of lists(containing dictionary ms items)
-            chain_object = chain.from_iterable(ms_body_arm_rest_items_excluded)
-            flattened_list = list(chain_object)
-            if not eachms in flattened_list:
+            #to avoid repeated analysis
+            if not id(eachms) in ms_body_arm_rest_items_excluded:
                 #from experience, the width and the x (center) of each body (bd0, bd2, bd4) should be a little narrower
                 if eachms['category'] == Category.bd0 or eachms['category'] == Category.bd2 or eachms['category'] == Category.bd4:
                     # eachms['x'] = eachms['x'] - (eachms['w']*0.2)
@@ -1346,9 +1380,10 @@ def annotateEachMS(horizontallysortedMSlist_input, current_accidental_table_inpu
                 if eachms['category'] == Category.bd1 or eachms['category'] == Category.bd3 or eachms['category'] == Category.bd5:
                     eachms['x'] = eachms['x'] - (eachms['w']*0.1)
                     eachms['w'] *= 0.8
+                ms_index.update(eachms)
 
                 #collect vertically overlapping ms items
-                vodMS = collectVerticallyOverlappingDescendingMusicalSymbols(horizontallysortedMSlist, eachms)
+                vodMS = collectVerticallyOverlappingDescendingMusicalSymbols(ms_index, eachms)
                 # print(f'vodMS(VerticallyOverlappingDescendingMusicalSymbols) is {vodMS}')
                 #first change the clef_temp and remove a clef if the included clef is before eachms or just remove it if after eachms
                 #if 8va, 8vb, or 8vstop　is included, change vodMS['clef'] and clef_temp accordingly and it should be removed from vodMS
@@ -1415,7 +1450,7 @@ def annotateEachMS(horizontallysortedMSlist_input, current_accidental_table_inpu
                                 prebody_intermediate_rest.append(item)
                             else:
                                 postbody_intermediate_rest.append(item)
-                            ms_body_arm_rest_items_excluded.append(item)
+                            ms_body_arm_rest_items_excluded.add(id(item))
                             vodMS.remove(item)
                             print('there is an intermediate rest ms item in vodMS[].')
                     else:
@@ -1493,7 +1528,7 @@ def annotateEachMS(horizontallysortedMSlist_input, current_accidental_table_inpu
                     if len(postbody_intermediate_rest) > 0:
                         all_vodMS_rest_items.append(postbody_intermediate_rest)
                     vodMS = excludeBeamFromvodMS(vodMS)
-                    ms_body_arm_rest_items_excluded.append(vodMS)
+                    ms_body_arm_rest_items_excluded.update(id(ms) for ms in vodMS)
 
                 #the case (2) where the bottom ms is a rest
                 elif ms_item_count >= 2 and isRest(vodMS[0]):
@@ -1509,7 +1544,7 @@ def annotateEachMS(horizontallysortedMSlist_input, current_accidental_table_inpu
                     if len(postbody_intermediate_rest) > 0:
                         all_vodMS_rest_items.append(postbody_intermediate_rest)
                     vodMS = excludeBeamFromvodMS(vodMS)
-                    ms_body_arm_rest_items_excluded.append(vodMS)
+                    ms_body_arm_rest_items_excluded.update(id(ms) for ms in vodMS)
                 #the case (3) where the top ms is a rest
                 elif ms_item_count >= 2 and isRest(vodMS[-1]):
                     areVoices = True
@@ -1524,7 +1559,7 @@ def annotateEachMS(horizontallysortedMSlist_input, current_accidental_table_inpu
                     if len(postbody_intermediate_rest) > 0:
                         all_vodMS_rest_items.append(postbody_intermediate_rest)
                     vodMS = excludeBeamFromvodMS(vodMS)
-                    ms_body_arm_rest_items_excluded.append(vodMS)
+                    ms_body_arm_rest_items_excluded.update(id(ms) for ms in vodMS)
                 #the case (4) where the bottom ms is an arm or beam ms and the top ms is a sticked or unsticked body
                 elif ms_item_count >= 2 and isArmOrBeam(vodMS[0]) and isBody(vodMS[-1]):
                     #annotate each ms component and assign voice1 to all
@@ -1536,7 +1571,7 @@ def annotateEachMS(horizontallysortedMSlist_input, current_accidental_table_inpu
                     if len(postbody_intermediate_rest) > 0:
                         all_vodMS_rest_items.append(postbody_intermediate_rest)
                     vodMS = excludeBeamFromvodMS(vodMS)
-                    ms_body_arm_rest_items_excluded.append(vodMS)
+                    ms_body_arm_rest_items_excluded.update(id(ms) for ms in vodMS)
                 #the case (5) where the top ms is an arm or beam ms and the bottom ms is a sticked or unsticked body
                 elif ms_item_count >= 2 and isArmOrBeam(vodMS[-1]) and isBody(vodMS[0]):
                     #annotate each ms component and assign voice1 to all
@@ -1548,7 +1583,7 @@ def annotateEachMS(horizontallysortedMSlist_input, current_accidental_table_inpu
                     if len(postbody_intermediate_rest) > 0:
                         all_vodMS_rest_items.append(postbody_intermediate_rest)
                     vodMS = excludeBeamFromvodMS(vodMS)
-                    ms_body_arm_rest_items_excluded.append(vodMS)
+                    ms_body_arm_rest_items_excluded.update(id(ms) for ms in vodMS)
                     #the case where both the top and bottom ms items are sticked/unsticked body ms items (including the only one sticked/unsticked body ms item)
                 #the case (6) where all ms items are body items (i.e., bd4 (whole) or bd5 (whole dot))
                 elif isBody(vodMS[0]) and isBody(vodMS[-1]):
@@ -1562,7 +1597,7 @@ def annotateEachMS(horizontallysortedMSlist_input, current_accidental_table_inpu
                     if len(postbody_intermediate_rest) > 0:
                         all_vodMS_rest_items.append(postbody_intermediate_rest)
                     vodMS = excludeBeamFromvodMS(vodMS)
-                    ms_body_arm_rest_items_excluded.append(vodMS)
+                    ms_body_arm_rest_items_excluded.update(id(ms) for ms in vodMS)
 
                 else:
                     #in the case of having any unannotated body (e.g., bd0, bd1, bd2, or bd3 without any upper or lower arm or beam)
@@ -1576,19 +1611,19 @@ def annotateEachMS(horizontallysortedMSlist_input, current_accidental_table_inpu
                     if len(postbody_intermediate_rest) > 0:
                         all_vodMS_rest_items.append(postbody_intermediate_rest)
                     vodMS = excludeBeamFromvodMS(vodMS)
-                    ms_body_arm_rest_items_excluded.append(vodMS)
+                    ms_body_arm_rest_items_excluded.update(id(ms) for ms in vodMS)
     
         #check any rest item independent from body items; i.e., any single intermediate rest item                
         elif isRest(eachms):
             #collect vertically overlapping ms items
-            vodMS = collectVerticallyOverlappingDescendingMusicalSymbols(horizontallysortedMSlist, eachms)
+            vodMS = collectVerticallyOverlappingDescendingMusicalSymbols(ms_index, eachms)
             #if vodMS contains any body item, this rest item should be analyzed in the body section
             if doesvodMSContainBody(vodMS):
                 print(f'this rest item{eachms["category"]} will be analyazed in the body section.')
             else:
                 eachms = annotateRestWithVoice(eachms, voice=1)
                 all_vodMS_rest_items.append([eachms])# append eachms as a list [eachms]
-                ms_body_arm_rest_items_excluded.append([eachms])
+                ms_body_arm_rest_items_excluded.add(id(eachms))
 
         else:
             pass
@@ -1666,6 +1701,74 @@ def annotateEachMS(horizontallysortedMSlist_input, current_accidental_table_inpu
 #for systemintegration
 # input data: isPaired(areStavesPaired), aligned_staves(staves_with_measures_in_sheetmusic), FILE_PATH (as an original sheet music image file path)
 
+#the label directories of a staff in the order their ms items are added to each measure
+SYMBOL_MODELS = ('body', 'armbeam', 'rest', 'accidental', 'clef')
+#label files are named after the measures (e.g., measure#012.txt)
+MEASURE_NAME_PATTERN = re.compile(r'measure#(\d+)')
+
+def giveCategoryCodes(models, model_indices, class_indices):
+    #class indices of the Yolov5 models (arrays) -> Category codes (array); unknown class indices -> Category.none
+    code_table = np.full((len(models), max(len(CATEGORIES_OF_EACHMODEL[model]) for model in models)), int(Category.none), dtype=np.int64)
+    for i, model in enumerate(models):
+        code_table[i, :len(CATEGORIES_OF_EACHMODEL[model])] = [int(category) for category in CATEGORIES_OF_EACHMODEL[model]]
+    class_indices = np.asarray(class_indices).astype(np.int64)
+    isKnown = (class_indices >= 0) & (class_indices < code_table.shape[1])
+    return np.where(isKnown, code_table[model_indices, np.clip(class_indices, 0, code_table.shape[1] - 1)], int(Category.none))
+
+def loadLabelArraysForStaff1or2(PATH_dirname, staff, models=SYMBOL_MODELS):
+    #read the label files (label x y w h [conf]) of all the models of a staff into columnar arrays:
+    #{'measure_idx', 'category' (Category codes), 'x', 'y', 'w', 'h', 'conf' (1.0 if not saved)} in the order of the models, the files and the lines
+    #the lines of all the files are converted to numbers at once (for each number of columns)
+    groups = {}#{column count: {'tokens', 'measure_idx', 'model_idx', 'row_idx'}}
+    row_count = 0
+    for model_idx, model in enumerate(models):
+        labels_PATH = PATH_dirname + '/staff' + str(staff) + '/' + model + '/labels'
+        if not os.path.isdir(labels_PATH):
+            continue
+        for filename in os.listdir(labels_PATH):
+            txtfile = labels_PATH + '/' + filename
+            if not filename.endswith('txt'):
+                print('The file is not a text file: {}'.format(txtfile))
+                continue
+            matched = MEASURE_NAME_PATTERN.match(filename)
+            if matched is None:
+                print('The file is not named after a measure: {}'.format(txtfile))
+                continue
+            with open(txtfile) as f:
+                text = f.read()
+            tokens = text.split()
+            if len(tokens) == 0:
+                continue
+            column_count = len(text.lstrip().split('\n', 1)[0].split())
+            line_count = len(tokens) // column_count
+            if column_count < 5 or line_count * column_count != len(tokens):
+                print('The label file is broken: {}'.format(txtfile))
+                continue
+            group = groups.setdefault(column_count, {'tokens':[], 'measure_idx':[], 'model_idx':[], 'row_idx':[]})
+            group['tokens'].extend(tokens)
+            group['measure_idx'].extend([int(matched.group(1))] * line_count)
+            group['model_idx'].extend([model_idx] * line_count)
+            group['row_idx'].extend(range(row_count, row_count + line_count))
+            row_count += line_count
+
+    measure_indices = [np.zeros(0, dtype=np.int64)]
+    model_indices = [np.zeros(0, dtype=np.int64)]
+    row_indices = [np.zeros(0, dtype=np.int64)]
+    values = [np.ones((0, 6))]#[[label, x, y, w, h, conf], ...]
+    for column_count, group in groups.items():
+        values_in_group = np.array(group['tokens'], dtype=np.float64).reshape(-1, column_count)
+        values_padded = np.ones((len(values_in_group), 6))
+        values_padded[:, :min(column_count, 6)] = values_in_group[:, :6]
+        values.append(values_padded)
+        measure_indices.append(np.array(group['measure_idx'], dtype=np.int64))
+        model_indices.append(np.array(group['model_idx'], dtype=np.int64))
+        row_indices.append(np.array(group['row_idx'], dtype=np.int64))
+    #put the rows back in the order of the files
+    order = np.argsort(np.concatenate(row_indices), kind='stable')
+    values = np.concatenate(values)[order]
+    return {'measure_idx':np.concatenate(measure_indices)[order], 'category':giveCategoryCodes(models, np.concatenate(model_indices)[order], values[:, 0]),
+        'x':values[:, 1], 'y':values[:, 2], 'w':values[:, 3], 'h':values[:, 4], 'conf':values[:, 5]}
+
 def collectAllmsInEachmeasureForStaff1or2(PATH_dirname, type_of_eachmeasure_input, staff):
     type_in_eachmeasure = copy.copy(type_of_eachmeasure_input)
     #serially add each ms in each category from each measure
@@ -1676,261 +1779,25 @@ def collectAllmsInEachmeasureForStaff1or2(PATH_dirname, type_of_eachmeasure_inpu
     # eachmeasure has an empty_ms as default
     for eachmeasure in type_in_eachmeasure:
         all_ms_in_eachmeasure[eachmeasure] = [empty_ms]
-    
-    #Category:body
-    body_PATH = PATH_dirname + '/staff' + str(staff) + '/body/labels/*'
-    print(f'body_PATHは{body_PATH}')
-    files = glob.glob(body_PATH)
-    
-    for file in files:
-        if not file.endswith('txt'):
-            print('The file is not a text file: {}'.format(file))
-        else:
-            dirname = os.path.dirname(file)
-            namewithoutext = os.path.splitext(os.path.basename(file))[0]
-            nameOfMeasure = namewithoutext[0:11]
-            txtfile = dirname + '/' + namewithoutext + '.txt'
-            # To obtain textlines
-            txtlines = []
-            with open(txtfile) as f:
-                txtlines = f.readlines()
-                for textline in txtlines:
-                    target_info = textline.split() #target_info =[label, x, y, w, h]
-                    ms_temp = copy.copy(musicalSymbol_template)
-                    ms_temp['measuretype'] = type_in_eachmeasure[nameOfMeasure]
-                    #assign clef
-                    if ms_temp['measuretype'] == MeasureType.x0:
-                        ms_temp['clef'] = Clef.G
-                    elif ms_temp['measuretype'] == MeasureType.x1:
-                        ms_temp['clef'] = Clef.F
-                    else:
-                        ms_temp['clef'] = Clef.none
-                    ms_temp['x'] = float(target_info[1])
-                    ms_temp['y'] = float(target_info[2])
-                    ms_temp['w'] = float(target_info[3])
-                    ms_temp['h'] = float(target_info[4])
-                    #depending on each category
-                    if target_info[0] == '0':
-                        ms_temp['category'] = Category.bd0
-                    elif target_info[0] == '1':
-                        ms_temp['category'] = Category.bd1
-                    elif target_info[0] == '2':
-                        ms_temp['category'] = Category.bd2
-                    elif target_info[0] == '3':
-                        ms_temp['category'] = Category.bd3
-                    elif target_info[0] == '4':
-                        ms_temp['category'] = Category.bd4
-                    elif target_info[0] == '5':
-                        ms_temp['category'] = Category.bd5
-                    else:
-                        ms_temp['category'] = Category.none
 
-                    # add ms to a previous [ms] in all_ms_in_eachmeasure['nameOfMeasure']
-                    previous_mslist = all_ms_in_eachmeasure[nameOfMeasure]
-                    previous_mslist.append(ms_temp)
-                    all_ms_in_eachmeasure[nameOfMeasure] = previous_mslist
-
-    #Category:armbeam
-    armbeam_PATH = PATH_dirname + '/staff' + str(staff) + '/armbeam/labels/*'
-    files = glob.glob(armbeam_PATH)
-    
-    for file in files:
-        if not file.endswith('txt'):
-            print('The file is not a text file: {}'.format(file))
+    #ms items of all the categories (body, armbeam, rest, accidental, and clef)
+    label_arrays = loadLabelArraysForStaff1or2(PATH_dirname, staff)
+    category_of_eachcode = {int(category):category for category in Category}
+    for measure_idx, code, x, y, w, h in zip(label_arrays['measure_idx'].tolist(), label_arrays['category'].tolist(),
+            label_arrays['x'].tolist(), label_arrays['y'].tolist(), label_arrays['w'].tolist(), label_arrays['h'].tolist()):
+        nameOfMeasure = 'measure#' + '{:0=3}'.format(measure_idx)
+        if nameOfMeasure not in type_in_eachmeasure:
+            print(f'{nameOfMeasure} is not a measure of staff{staff}')
+            continue
+        ms_temp = MusicalSymbol(measuretype=type_in_eachmeasure[nameOfMeasure], category=category_of_eachcode[code], x=x, y=y, w=w, h=h)
+        #assign clef
+        if ms_temp['measuretype'] == MeasureType.x0:
+            ms_temp['clef'] = Clef.G
+        elif ms_temp['measuretype'] == MeasureType.x1:
+            ms_temp['clef'] = Clef.F
         else:
-            dirname = os.path.dirname(file)
-            namewithoutext = os.path.splitext(os.path.basename(file))[0]
-            nameOfMeasure = namewithoutext[0:11]
-            txtfile = dirname + '/' + namewithoutext + '.txt'
-            # To obtain textlines
-            txtlines = []
-            with open(txtfile) as f:
-                txtlines = f.readlines()
-                for textline in txtlines:
-                    target_info = textline.split() #target_info =[label, x, y, w, h]
-                    ms_temp = copy.copy(musicalSymbol_template)
-                    ms_temp['measuretype'] = type_in_eachmeasure[nameOfMeasure]
-                    #assign clef
-                    if ms_temp['measuretype'] == MeasureType.x0:
-                        ms_temp['clef'] = Clef.G
-                    elif ms_temp['measuretype'] == MeasureType.x1:
-                        ms_temp['clef'] = Clef.F
-                    else:
-                        ms_temp['clef'] = Clef.none
-                    ms_temp['x'] = float(target_info[1])
-                    ms_temp['y'] = float(target_info[2])
-                    ms_temp['w'] = float(target_info[3])
-                    ms_temp['h'] = float(target_info[4])
-                    #depending on each category
-                    if target_info[0] == '0':
-                        ms_temp['category'] = Category.am0
-                    elif target_info[0] == '1':
-                        ms_temp['category'] = Category.am1
-                    elif target_info[0] == '2':
-                        ms_temp['category'] = Category.am2
-                    elif target_info[0] == '3':
-                        ms_temp['category'] = Category.am3
-                    elif target_info[0] == '4':
-                        ms_temp['category'] = Category.bm0
-                    elif target_info[0] == '5':
-                        ms_temp['category'] = Category.bm1
-                    elif target_info[0] == '6':
-                        ms_temp['category'] = Category.bm2
-                    elif target_info[0] == '7':
-                        ms_temp['category'] = Category.bm3
-                    else:
-                        ms_temp['category'] = Category.none
-
-                    # add ms to a previous [ms] in all_ms_in_eachmeasure['nameOfMeasure']
-                    previous_mslist = all_ms_in_eachmeasure[nameOfMeasure]
-                    previous_mslist.append(ms_temp)
-                    all_ms_in_eachmeasure[nameOfMeasure] = previous_mslist
-
-    #Category:rest
-    rest_PATH = PATH_dirname + '/staff' + str(staff) + '/rest/labels/*'
-    files = glob.glob(rest_PATH)
-    
-    for file in files:
-        if not file.endswith('txt'):
-            print('The file is not a text file: {}'.format(file))
-        else:
-            dirname = os.path.dirname(file)
-            namewithoutext = os.path.splitext(os.path.basename(file))[0]
-            nameOfMeasure = namewithoutext[0:11]
-            txtfile = dirname + '/' + namewithoutext + '.txt'
-            # To obtain textlines
-            txtlines = []
-            with open(txtfile) as f:
-                txtlines = f.readlines()
-                for textline in txtlines:
-                    target_info = textline.split() #target_info =[label, x, y, w, h]
-                    ms_temp = copy.copy(musicalSymbol_template)
-                    ms_temp['measuretype'] = type_in_eachmeasure[nameOfMeasure]
-                    #assign clef
-                    if ms_temp['measuretype'] == MeasureType.x0:
-                        ms_temp['clef'] = Clef.G
-                    elif ms_temp['measuretype'] == MeasureType.x1:
-                        ms_temp['clef'] = Clef.F
-                    else:
-                        ms_temp['clef'] = Clef.none
-                    ms_temp['x'] = float(target_info[1])
-                    ms_temp['y'] = float(target_info[2])
-                    ms_temp['w'] = float(target_info[3])
-                    ms_temp['h'] = float(target_info[4])
-                    #depending on each category
-                    if target_info[0] == '0':
-                        ms_temp['category'] = Category.re0
-                    elif target_info[0] == '1':
-                        ms_temp['category'] = Category.re1
-                    elif target_info[0] == '2':
-                        ms_temp['category'] = Category.re2
-                    elif target_info[0] == '3':
-                        ms_temp['category'] = Category.re3
-                    elif target_info[0] == '4':
-                        ms_temp['category'] = Category.re4
-                    else:
-                        ms_temp['category'] = Category.none
-
-                    # add ms to a previous [ms] in all_ms_in_eachmeasure['nameOfMeasure']
-                    previous_mslist = all_ms_in_eachmeasure[nameOfMeasure]
-                    previous_mslist.append(ms_temp)
-                    all_ms_in_eachmeasure[nameOfMeasure] = previous_mslist
-    #Category:accidental
-    accidental_PATH = PATH_dirname + '/staff' + str(staff) + '/accidental/labels/*'
-    files = glob.glob(accidental_PATH)
-    
-    for file in files:
-        if not file.endswith('txt'):
-            print('The file is not a text file: {}'.format(file))
-        else:
-            dirname = os.path.dirname(file)
-            namewithoutext = os.path.splitext(os.path.basename(file))[0]
-            nameOfMeasure = namewithoutext[0:11]
-            txtfile = dirname + '/' + namewithoutext + '.txt'
-            # To obtain textlines
-            txtlines = []
-            with open(txtfile) as f:
-                txtlines = f.readlines()
-                for textline in txtlines:
-                    target_info = textline.split() #target_info =[label, x, y, w, h]
-                    ms_temp = copy.copy(musicalSymbol_template)
-                    ms_temp['measuretype'] = type_in_eachmeasure[nameOfMeasure]
-                    #assign clef
-                    if ms_temp['measuretype'] == MeasureType.x0:
-                        ms_temp['clef'] = Clef.G
-                    elif ms_temp['measuretype'] == MeasureType.x1:
-                        ms_temp['clef'] = Clef.F
-                    else:
-                        ms_temp['clef'] = Clef.none
-                    ms_temp['x'] = float(target_info[1])
-                    ms_temp['y'] = float(target_info[2])
-                    ms_temp['w'] = float(target_info[3])
-                    ms_temp['h'] = float(target_info[4])
-                    #depending on each category
-                    if target_info[0] == '0':
-                        ms_temp['category'] = Category.ac0
-                    elif target_info[0] == '1':
-                        ms_temp['category'] = Category.ac1
-                    elif target_info[0] == '2':
-                        ms_temp['category'] = Category.ac2
-                    else:
-                        ms_temp['category'] = Category.none
-
-                    # add ms to a previous [ms] in all_ms_in_eachmeasure['nameOfMeasure']
-                    previous_mslist = all_ms_in_eachmeasure[nameOfMeasure]
-                    previous_mslist.append(ms_temp)
-                    all_ms_in_eachmeasure[nameOfMeasure] = previous_mslist
-
-    #Category:clef
-    accidental_PATH = PATH_dirname + '/staff' + str(staff) + '/clef/labels/*'
-    files = glob.glob(accidental_PATH)
-    
-    for file in files:
-        if not file.endswith('txt'):
-            print('The file is not a text file: {}'.format(file))
-        else:
-            dirname = os.path.dirname(file)
-            namewithoutext = os.path.splitext(os.path.basename(file))[0]
-            nameOfMeasure = namewithoutext[0:11]
-            txtfile = dirname + '/' + namewithoutext + '.txt'
-            # To obtain textlines
-            txtlines = []
-            with open(txtfile) as f:
-                txtlines = f.readlines()
-                for textline in txtlines:
-                    target_info = textline.split() #target_info =[label, x, y, w, h]
-                    ms_temp = copy.copy(musicalSymbol_template)
-                    ms_temp['measuretype'] = type_in_eachmeasure[nameOfMeasure]
-                    #assign clef
-                    if ms_temp['measuretype'] == MeasureType.x0:
-                        ms_temp['clef'] = Clef.G
-                    elif ms_temp['measuretype'] == MeasureType.x1:
-                        ms_temp['clef'] = Clef.F
-                    else:
-                        ms_temp['clef'] = Clef.none
-                    ms_temp['x'] = float(target_info[1])
-                    ms_temp['y'] = float(target_info[2])
-                    ms_temp['w'] = float(target_info[3])
-                    ms_temp['h'] = float(target_info[4])
-                    #depending on each category
-                    if target_info[0] == '0':
-                        ms_temp['category'] = Category.cf0
-                    elif target_info[0] == '1':
-                        ms_temp['category'] = Category.cf1
-                    elif target_info[0] == '2':
-                        ms_temp['category'] = Category.cf2
-                    elif target_info[0] == '3':
-                        ms_temp['category'] = Category.cf3
-                    elif target_info[0] == '4':
-                        ms_temp['category'] = Category.cf4
-                    else:
-                        ms_temp['category'] = Category.none
-
-                    # add ms to a previous [ms] in all_ms_in_eachmeasure['nameOfMeasure']
-                    previous_mslist = all_ms_in_eachmeasure[nameOfMeasure]
-                    previous_mslist.append(ms_temp)
-                    all_ms_in_eachmeasure[nameOfMeasure] = previous_mslist
-
+            ms_temp['clef'] = Clef.none
+        all_ms_in_eachmeasure[nameOfMeasure].append(ms_temp)
     
     return all_ms_in_eachmeasure
 
@@ -2023,72 +1890,92 @@ def giveblackarea(img_input):
     # print(f'blackPixelsは{blackPixels}')
     return blackPixels
 """
-def giveblackarea(img_input):
-    img = copy.copy(img_input)   
-    #http://labs.eecs.tottori-u.ac.jp/sd/Member/oyamada/OpenCV/html/py_tutorials/py_imgproc/py_thresholding/py_thresholding.html
-    img = cv2.cvtColor(img, cv2.COLOR_RGB2GRAY)
-    img = cv2.medianBlur(img,5)
-    img_processed = cv2.adaptiveThreshold(img,255,cv2.ADAPTIVE_THRESH_GAUSSIAN_C,\
-            cv2.THRESH_BINARY,11,2)
-    whole_area = img_processed.size
-    whitePixels = cv2.countNonZero(img_processed)
-    blackPixels = whole_area - whitePixels
-    # print(f'blackPixelsは{blackPixels}')
-    return blackPixels
+#the staff lines are found directly by adjustalphabeta; if they are unclear, alpha and beta are searched in the ranges below
+#(the black area is evaluated by the shared engine: binarized once, exact same result as the brute-force search)
+from adjustalphabeta.adjustalphabeta import determine_alphabeta as determine_alphabeta_in_ranges, determine_alphabeta_and_isSearched as determine_alphabeta_and_isSearched_in_ranges
+from enlargemeasures.enlargeeachmeasure import load_measure_images
 
 
 def determine_alphabeta(img_input):
-    img_template = copy.copy(img_input)
-    img_copy = copy.copy(img_input)
-    height, width, c = img_template.shape
-    alpha_best = 0.0
-    beta_best = 0.0
-    blackarea_minimum = 416 * 416 #the size of img
-    for alpha_pre in range(-40, 40):
-        alpha = float(alpha_pre / 1000)
-        for beta_pre in range(-5, 5):
-            beta = float(beta_pre / 1000)
-            staffmiddle = int(0.5*416 + alpha*416)
-            heightInterval =  int(height/(8 +2*(8*1.2)) + beta*416)
-            img_copy = copy.copy(img_template)
-            for i in range(0,3):
-                #draw an upper and a lower line:blue
-                upper_line_position = int(staffmiddle - 2*heightInterval*i)
-                if upper_line_position >= 0:
-                    img_copy = cv2.line(img_copy,(0,upper_line_position),(416,upper_line_position),(255,0,0),2)
-                lower_line_position = int(staffmiddle + 2*heightInterval*i)
-                if upper_line_position <= 416:
-                    img_copy = cv2.line(img_copy,(0,lower_line_position),(416,lower_line_position),(255,0,0),2)
-            #draw a middle line:red and title in the image
-            img_copy = cv2.line(img_copy,(0,staffmiddle),(416,staffmiddle),(0,0,255),2)
-            blackarea = giveblackarea(img_copy)
-            if blackarea < blackarea_minimum:
-                alpha_best = alpha
-                beta_best = beta
-                blackarea_minimum = blackarea
-    return alpha_best, beta_best
-
-
-
-
-def generateMSsequenceForStaff1or2(all_ms_in_eachmeasure_input, current_accidental_table_input, staff, current_clef_input, preset_measure_duration, FILE_PATH, isWideStaff=False):
-    all_ms_in_eachmeasure = copy.copy(all_ms_in_eachmeasure_input)
-    current_accidental_table_original = copy.copy(current_accidental_table_input)
-    
-    current_clef = copy.copy(current_clef_input)
-    #obtain PATH for each measure# image
+    alphas = [float(alpha_pre / 1000) for alpha_pre in range(-40, 40)]
+    betas = [float(beta_pre / 1000) for beta_pre in range(-5, 5)]
+    return determine_alphabeta_in_ranges(img_input, alphas, betas)
+
+
+def determine_alphabeta_and_isSearched(img_input):
+    #as determine_alphabeta, also telling whether alpha and beta were searched (counted by calibrateMeasures, as the workers' counts are not reported)
+    alphas = [float(alpha_pre / 1000) for alpha_pre in range(-40, 40)]
+    betas = [float(beta_pre / 1000) for beta_pre in range(-5, 5)]
+    return determine_alphabeta_and_isSearched_in_ranges(img_input, alphas, betas)
+
+
+
+
+#the number of worker processes for calibrateMeasures (None: the number of CPUs)
+CALIBRATION_WORKERS = None
+
+
+def giveMeasureImagesForStaff1or2(all_ms_in_eachmeasure, staff, FILE_PATH):
+    #read the measure images having musical symbols from ./measure/staff1 or staff2 as {'measure#000':img, ...}
+    #(saved as png by detectionintegration.py)
     files_temp = glob.glob(FILE_PATH) #"./tmp/*":beforehand prepare images and Yolov5 anotation files in ./tmp/subdirectory
     
     FILE_DIR_PATH = ''
-    FILE_EXT = ''
     for file_temp in files_temp:
         if file_temp.endswith('jpg') or file_temp.endswith('png'):
             FILE_DIR_PATH = os.path.dirname(file_temp)
-            FILE_BASENAME = os.path.basename(file_temp)
-            FILE_BASENAME_WITHOUTEXT = os.path.splitext(FILE_BASENAME)[0]
-            FILE_EXT = os.path.splitext(FILE_BASENAME)[1]
             
-    MEASURE_DIR = FILE_DIR_PATH + '/measure/staff' + str(staff) +'/'
+    MEASURE_DIR = FILE_DIR_PATH + '/measure/staff' + str(staff)
+    measure_images_in_dir = load_measure_images(MEASURE_DIR)
+    measure_images = {}
+    # count excluding a dummy item
+    measure_count = len(all_ms_in_eachmeasure) -1
+    for i in range(0, measure_count):
+        nameOfMeasure = 'measure#' + '{:0=3}'.format(i)
+        if nameOfMeasure in all_ms_in_eachmeasure:
+            measure_images[nameOfMeasure] = measure_images_in_dir[nameOfMeasure]
+    return measure_images
+
+
+def initializeCalibrationWorker():
+    #each worker uses one core; the pool provides the parallelism
+    cv2.setNumThreads(1)
+
+
+@instrument()
+def calibrateMeasures(*measure_images_in_eachstaff, max_workers=CALIBRATION_WORKERS):
+    #determine alpha and beta of all measures (e.g., of staff1 and staff2) at once in a process pool
+    #measure_images_in_eachstaff: {'measure#000':img, ...} for each staff
+    #return {'measure#000':(alpha, beta), ...} for each staff in the same order
+    keys = [(k, nameOfMeasure) for k, measure_images in enumerate(measure_images_in_eachstaff) for nameOfMeasure in measure_images]
+    count('measures calibrated', len(keys))
+    imgs = [measure_images_in_eachstaff[k][nameOfMeasure] for k, nameOfMeasure in keys]
+    if max_workers == 1 or len(imgs) <= 1:
+        results = [determine_alphabeta_and_isSearched(img) for img in imgs]
+    else:
+        #fork (where available) does not re-run the calling script in each worker
+        mp_context = multiprocessing.get_context('fork') if 'fork' in multiprocessing.get_all_start_methods() else None
+        workers = max_workers if max_workers is not None else (os.cpu_count() or 1)
+        with ProcessPoolExecutor(max_workers=workers, mp_context=mp_context, initializer=initializeCalibrationWorker) as executor:
+            results = list(executor.map(determine_alphabeta_and_isSearched, imgs, chunksize=max(1, len(imgs) // (workers*4))))
+    count('alpha/beta searched', sum(isSearched for alpha, beta, isSearched in results))
+    alphabetas_in_eachstaff = tuple({} for measure_images in measure_images_in_eachstaff)
+    for (k, nameOfMeasure), (alpha, beta, isSearched) in zip(keys, results):
+        alphabetas_in_eachstaff[k][nameOfMeasure] = (alpha, beta)
+    return alphabetas_in_eachstaff
+
+
+def generateMSsequenceForStaff1or2(all_ms_in_eachmeasure_input, current_accidental_table_input, staff, current_clef_input, preset_measure_duration, FILE_PATH, isWideStaff=False, measure_images=None, alphabetas=None):
+    #measure_images = {'measure#000':img, ...}: if given, the measure images in memory are used instead of ./measure/staff1 or staff2
+    #alphabetas = {'measure#000':(alpha, beta), ...}: if given (e.g., by calibrateMeasures), alpha and beta are not determined here
+    all_ms_in_eachmeasure = copy.copy(all_ms_in_eachmeasure_input)
+    current_accidental_table_original = copy.copy(current_accidental_table_input)
+    
+    current_clef = copy.copy(current_clef_input)
+    if alphabetas is None:
+        if measure_images is None:
+            measure_images = giveMeasureImagesForStaff1or2(all_ms_in_eachmeasure, staff, FILE_PATH)
+        alphabetas = calibrateMeasures(measure_images, max_workers=1)[0]
     #return results as
     ms_sequenceOfInterest = []
     # count excluding a dummy item
@@ -2096,10 +1983,8 @@ def generateMSsequenceForStaff1or2(all_ms_in_eachmeasure_input, current_accident
     for i in range(0, measure_count):
         nameOfMeasure = 'measure#' + '{:0=3}'.format(i)
         if nameOfMeasure in all_ms_in_eachmeasure:
-            #determine alpha, beta
-            MEASURE_PATH = MEASURE_DIR + nameOfMeasure + FILE_EXT
-            img_measure = cv2.imread(MEASURE_PATH)
-            alpha, beta = determine_alphabeta(img_measure)
+            #alpha, beta determined beforehand
+            alpha, beta = alphabetas[nameOfMeasure]
             print(f'{nameOfMeasure}: alpha is {alpha} and beta is {beta}')
             #sort ms items horizontally
             hsMSlist = ms_horizontalsorting(all_ms_in_eachmeasure[nameOfMeasure])#hs means horizontally sorted one
@@ -2272,10 +2157,9 @@ def giveClefDict(eachnote_ms, staff):
     return {nameOfAttributes_added:attributes_added_unit[nameOfAttributes_added]}
 
 
-def generateDictForET_singlestaff(ms_sequenceOfInterest_staff_input, tempo, beats, beat_type, fifths, clef):
-    ms_sequenceOfInterest_staff = copy.copy(ms_sequenceOfInterest_staff_input)
-    music_data_template = {'part':{}}
-    measure_group_dict = {}
+def giveMeasureDictsForET_singlestaff(ms_sequenceOfInterest_staff_input, tempo, beats, beat_type, fifths, clef):
+    #yield the dictionary of each measure (as in generateDictForET_singlestaff) one by one, e.g., for yoloToxml.writeMusicXMLStream
+    ms_sequenceOfInterest_staff = ms_sequenceOfInterest_staff_input
     #set clef string (G or F)
     clef_str = ''
     line_str = '2'
@@ -2286,44 +2170,31 @@ def generateDictForET_singlestaff(ms_sequenceOfInterest_staff_input, tempo, beat
         clef_str = 'F'
         line_str = '4'
     #in the case of only staff 1
-    if len(ms_sequenceOfInterest_staff) > 0:
-        for i, eachmeasure in enumerate(ms_sequenceOfInterest_staff):
-            nameOfMeasure = 'measure' + str(i+1)
-            component_unit = {}
-            note_count = 1
-            direction_count = 1
-            if i == 0:
-                #when i == 0, provides basic sheet music information
-                component_unit[nameOfMeasure] = {'attrib': {'number':str(i+1),'width':'360'},'attributes': {'divisions':'256','key':{'fifths':str(fifths),'mode':'major'},'time':{'beats':str(beats),'beat-type':str(beat_type)},'staves':'1','clef':{'sign':clef_str,'line':line_str }} }#'direction0':{'sound':{'tempo':str(tempo)}}
-                for j, eachnote_ms in enumerate(eachmeasure):
-                    if isBody(eachnote_ms):
-                        component_unit[nameOfMeasure].update(giveBodyNoteDict(eachnote_ms, note_count=note_count, staff=1))
-                        note_count += 1
-                    elif isRest(eachnote_ms):
-                        component_unit[nameOfMeasure].update(giveRestNoteDict(eachnote_ms, note_count=note_count, staff=1))
-                        note_count += 1
-                    elif eachnote_ms['octave_shift'] != '':
-                        component_unit[nameOfMeasure].update(giveDirectionDict(eachnote_ms, direction_count=direction_count, staff=1))
-                    elif eachnote_ms['clefchange'] == True:
-                        component_unit[nameOfMeasure].update(giveClefDict(eachnote_ms, staff=1))
-
-                music_data_template['part'].update({nameOfMeasure:component_unit[nameOfMeasure]})
-            else:
-                component_unit[nameOfMeasure] = {'attrib': {'number':str(i+1),'width':'360'}}
-                for j, eachnote_ms in enumerate(eachmeasure):
-                        if isBody(eachnote_ms):
-                            component_unit[nameOfMeasure].update(giveBodyNoteDict(eachnote_ms, note_count=note_count, staff=1))
-                            note_count += 1
-                        elif isRest(eachnote_ms):
-                            component_unit[nameOfMeasure].update(giveRestNoteDict(eachnote_ms, note_count=note_count, staff=1))
-                            note_count += 1
-                        elif eachnote_ms['octave_shift'] == 'down' or eachnote_ms['octave_shift'] == 'up' or eachnote_ms['octave_shift'] == 'stop':
-                            component_unit[nameOfMeasure].update(giveDirectionDict(eachnote_ms, direction_count=direction_count, staff=1))
-                        elif eachnote_ms['clefchange'] == True:
-                            component_unit[nameOfMeasure].update(giveClefDict(eachnote_ms, staff=1))
-                music_data_template['part'].update({nameOfMeasure:component_unit[nameOfMeasure]})
-        
-        return music_data_template    
-
+    for i, eachmeasure in enumerate(ms_sequenceOfInterest_staff):
+        note_count = 1
+        direction_count = 1
+        if i == 0:
+            #when i == 0, provides basic sheet music information
+            measure_dict = {'attrib': {'number':str(i+1),'width':'360'},'attributes': {'divisions':'256','key':{'fifths':str(fifths),'mode':'major'},'time':{'beats':str(beats),'beat-type':str(beat_type)},'staves':'1','clef':{'sign':clef_str,'line':line_str }} }#'direction0':{'sound':{'tempo':str(tempo)}}
+        else:
+            measure_dict = {'attrib': {'number':str(i+1),'width':'360'}}
+        for j, eachnote_ms in enumerate(eachmeasure):
+            if isBody(eachnote_ms):
+                measure_dict.update(giveBodyNoteDict(eachnote_ms, note_count=note_count, staff=1))
+                note_count += 1
+            elif isRest(eachnote_ms):
+                measure_dict.update(giveRestNoteDict(eachnote_ms, note_count=note_count, staff=1))
+                note_count += 1
+            elif eachnote_ms['octave_shift'] == 'down' or eachnote_ms['octave_shift'] == 'up' or eachnote_ms['octave_shift'] == 'stop':
+                measure_dict.update(giveDirectionDict(eachnote_ms, direction_count=direction_count, staff=1))
+            elif eachnote_ms['clefchange'] == True:
+                measure_dict.update(giveClefDict(eachnote_ms, staff=1))
+        yield measure_dict
 
 
+def generateDictForET_singlestaff(ms_sequenceOfInterest_staff_input, tempo, beats, beat_type, fifths, clef):
+    music_data_template = {'part':{}}
+    for i, measure_dict in enumerate(giveMeasureDictsForET_singlestaff(ms_sequenceOfInterest_staff_input, tempo, beats, beat_type, fifths, clef)):
+        nameOfMeasure = 'measure' + str(i+1)
+        music_data_template['part'].update({nameOfMeasure:measure_dict})
+    return music_data_template
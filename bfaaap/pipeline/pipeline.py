@@ -0,0 +1,423 @@
+# coding: UTF-8
+""" Pipeline
+    To convert a sheet music image into musicXML files in explicit stages
+    (level, staff-detect, align, crop, level-measures, symbol-detect, parse, calibrate, annotate, emit)
+    each stage records its outputs and the fingerprint of its inputs and settings in a per-score manifest,
+    so that an interrupted or partially changed run resumes from the first stale stage
+    rerender() rebuilds only annotate and emit from the persisted symbols and calibrations (e.g., for another key signature)
+"""
+import glob
+import hashlib
+import json
+import os
+import pickle
+import shutil
+import time
+
+from instrumentation import instrumentation
+
+STAGES = ('level', 'staff-detect', 'align', 'crop', 'level-measures', 'symbol-detect', 'parse', 'calibrate', 'annotate', 'emit')
+#the stages depending on the key and meter parameters only
+RERENDER_STAGES = ('annotate', 'emit')
+
+#the stages whose outputs are the inputs of each stage
+STAGE_INPUTS = {
+    'level':(),
+    'staff-detect':('level',),
+    'align':('staff-detect',),
+    'crop':('level', 'align'),
+    'level-measures':('crop',),
+    'symbol-detect':('level-measures',),
+    'parse':('align', 'symbol-detect'),
+    'calibrate':('level-measures',),
+    'annotate':('parse', 'calibrate'),
+    'emit':('annotate',),
+}
+
+#the settings used in each stage (a change of them makes the stage stale)
+STAGE_SETTINGS = {
+    'level':(),
+    'staff-detect':('staff_conf_thres',),
+    'align':(),
+    'crop':('areStavesPaired', 'staff_magnification'),
+    'level-measures':(),
+    'symbol-detect':('symbol_conf_thres',),
+    'parse':('areStavesPaired',),
+    'calibrate':(),
+    'annotate':('isWideStaff', 'beats', 'beat_type', 'fifths', 'clef_staff1', 'clef_staff2'),
+    'emit':('tempo', 'beats', 'beat_type', 'fifths', 'clef_staff1', 'clef_staff2', 'xml_indent', 'xml_variants', 'xml_format'),
+}
+
+DEFAULT_SETTINGS = {
+    'areStavesPaired':True,
+    #in the case of wide staff extraction, set staff_magnification = 1.2
+    'staff_magnification':1.2,
+    'isWideStaff':False,
+    'tempo':60,
+    'beats':3,
+    'beat_type':2,
+    'fifths':-1,
+    'clef_staff1':'G',
+    'clef_staff2':'F',
+    'staff_conf_thres':0.75,
+    'symbol_conf_thres':0.60,
+    #indentation of the musicXML files (None: compact without any whitespace between the elements)
+    'xml_indent':'   ',
+    #the musicXML files to write: each staff as a single-staff score and both staves in one part
+    'xml_variants':['staff1', 'staff2', 'staves1and2'],
+    #'xml' or 'mxl' (compressed musicXML; with xml_indent None for the smallest files)
+    'xml_format':'xml',
+    #the number of worker processes for calibration (None: the number of CPUs); not a part of the fingerprints
+    'calibration_workers':None,
+}
+
+MANIFEST_NAME = 'manifest.json'
+
+
+def openScore(FILE_PATH, settings=None):
+    #score = the paths of a sheet music image (musicdata/AAA/BBB.jpg) and its intermediate files, the settings and the results kept in memory
+    dirname = os.path.dirname(os.path.abspath(FILE_PATH))
+    basename = os.path.basename(FILE_PATH)
+    namewithoutext, ext = os.path.splitext(basename)
+    LEVELED_FILE_PATH = dirname + '/leveled_' + namewithoutext + ext.lower()
+    leveled_namewithoutext = os.path.splitext(os.path.basename(LEVELED_FILE_PATH))[0]
+    score = {
+        'FILE_PATH':os.path.abspath(FILE_PATH),
+        'dirname':dirname,
+        'LEVELED_FILE_PATH':LEVELED_FILE_PATH,
+        'STAFF_LABEL_PATH':dirname + '/staff/labels/' + leveled_namewithoutext + '.txt',
+        'XML_PATH_PREFIX':dirname + '/xml/' + leveled_namewithoutext,
+        'PIPELINE_DIR':dirname + '/pipeline/' + namewithoutext,
+        'settings':dict(DEFAULT_SETTINGS, **(settings or {})),
+        'memory':{},
+    }
+    score['MANIFEST_PATH'] = score['PIPELINE_DIR'] + '/' + MANIFEST_NAME
+    return score
+
+
+"""
+manifest
+"""
+def give_file_hash(path):
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+def load_manifest(score):
+    if os.path.exists(score['MANIFEST_PATH']):
+        with open(score['MANIFEST_PATH']) as f:
+            return json.load(f)
+    return {'score':os.path.basename(score['FILE_PATH']), 'settings':{}, 'stages':{}}
+
+
+def save_manifest(score, manifest):
+    #write a temporary file first so that an interrupted run never leaves a broken manifest
+    os.makedirs(score['PIPELINE_DIR'], exist_ok=True)
+    tmp_PATH = score['MANIFEST_PATH'] + '.tmp'
+    with open(tmp_PATH, 'w') as f:
+        json.dump(manifest, f, indent=1, ensure_ascii=False)
+    os.replace(tmp_PATH, score['MANIFEST_PATH'])
+
+
+def give_stage_inputs(score, manifest, stage):
+    #{relative path: hash} of the input files of a stage
+    if stage == 'level':
+        return {os.path.basename(score['FILE_PATH']):give_file_hash(score['FILE_PATH'])}
+    inputs = {}
+    for input_stage in STAGE_INPUTS[stage]:
+        inputs.update(manifest['stages'][input_stage]['outputs'])
+    return inputs
+
+
+def give_stage_fingerprint(score, stage, inputs):
+    settings = {key:score['settings'][key] for key in STAGE_SETTINGS[stage]}
+    text = json.dumps({'stage':stage, 'settings':settings, 'inputs':inputs}, sort_keys=True)
+    return hashlib.sha1(text.encode()).hexdigest()
+
+
+def give_output_hashes(score, output_PATHs):
+    return {os.path.relpath(path, score['dirname']):give_file_hash(path) for path in sorted(output_PATHs)}
+
+
+def isStageFresh(score, manifest, stage, fingerprint):
+    #fresh: run with the same inputs and settings, and all of its outputs are unchanged
+    record = manifest['stages'].get(stage)
+    if record is None or record['fingerprint'] != fingerprint:
+        return False
+    for relative_PATH, output_hash in record['outputs'].items():
+        path = os.path.join(score['dirname'], relative_PATH)
+        if not os.path.exists(path) or give_file_hash(path) != output_hash:
+            return False
+    return True
+
+
+def run_stages(score, manifest, stages, force=False):
+    #run the stages in order, skipping the fresh ones
+    manifest['settings'] = score['settings']
+    for stage in stages:
+        inputs = give_stage_inputs(score, manifest, stage)
+        fingerprint = give_stage_fingerprint(score, stage, inputs)
+        if not force and isStageFresh(score, manifest, stage, fingerprint):
+            print(f'{stage}: up to date')
+            continue
+        start = time.time()
+        with instrumentation.span('stage ' + stage):
+            output_PATHs = STAGE_FUNCTIONS[stage](score)
+        manifest['stages'][stage] = {'fingerprint':fingerprint, 'outputs':give_output_hashes(score, output_PATHs), 'elapsed_time':time.time() - start}
+        save_manifest(score, manifest)
+        print(f'{stage}: done in {time.time() - start:.2f} sec')
+    return manifest
+
+
+def write_run_report(score, trace=False):
+    #pipeline/<score>/report.json: wall time, CPU time and counts of the run (and trace.json for chrome://tracing)
+    instrumentation.write_report(score['PIPELINE_DIR'] + '/report.json', score=os.path.basename(score['FILE_PATH']))
+    if trace:
+        instrumentation.write_chrome_trace(score['PIPELINE_DIR'] + '/trace.json')
+
+
+def run_pipeline(FILE_PATH, settings=None, until='emit', force=False, trace=False):
+    #run the stages of a score up to the stage `until`
+    instrumentation.reset()
+    score = openScore(FILE_PATH, settings)
+    manifest = load_manifest(score)
+    try:
+        run_stages(score, manifest, STAGES[:STAGES.index(until) + 1], force=force)
+    finally:
+        write_run_report(score, trace=trace)
+    return score
+
+
+def give_score_FILE_PATHs(score_dir):
+    #the sheet music images in score_dir (musicdata/AAA) which have been run through the pipeline
+    FILE_PATHs = []
+    for MANIFEST_PATH in sorted(glob.glob(score_dir + '/pipeline/*/' + MANIFEST_NAME)):
+        with open(MANIFEST_PATH) as f:
+            FILE_PATHs.append(os.path.join(score_dir, json.load(f)['score']))
+    return FILE_PATHs
+
+
+def rerender(score_dir, FILE_NAME=None, trace=False, **settings):
+    #rebuild the musicXML files with other key and meter parameters (e.g., rerender('musicdata/AAA', fifths=2, beats=4, beat_type=4))
+    #the symbols and the calibrations persisted by run_pipeline are reused and no image is processed
+    #the parameters not given are those of the previous run; return the paths of the musicXML files
+    FILE_PATHs = give_score_FILE_PATHs(score_dir)
+    if FILE_NAME is not None:
+        FILE_PATHs = [FILE_PATH for FILE_PATH in FILE_PATHs if os.path.basename(FILE_PATH) == FILE_NAME]
+    if len(FILE_PATHs) != 1:
+        raise ValueError(f'{score_dir} has {len(FILE_PATHs)} scores run through the pipeline; give one of {[os.path.basename(FILE_PATH) for FILE_PATH in FILE_PATHs]} as FILE_NAME')
+    unknown_settings = [key for key in settings if key not in DEFAULT_SETTINGS]
+    if len(unknown_settings) > 0:
+        raise ValueError(f'unknown settings: {unknown_settings}')
+    score = openScore(FILE_PATHs[0])
+    manifest = load_manifest(score)
+    for stage in STAGES[:STAGES.index(RERENDER_STAGES[0])]:
+        if stage not in manifest['stages']:
+            raise ValueError(f'the stage {stage} has not been run for {score["FILE_PATH"]}; run run_pipeline first')
+        for key in STAGE_SETTINGS[stage]:
+            if key in settings and settings[key] != manifest['settings'].get(key):
+                raise ValueError(f'{key} is used in the stage {stage}; run run_pipeline to change it')
+    score['settings'].update(manifest['settings'])
+    score['settings'].update(settings)
+    instrumentation.reset()
+    try:
+        manifest = run_stages(score, manifest, RERENDER_STAGES)
+    finally:
+        write_run_report(score, trace=trace)
+    return [os.path.join(score['dirname'], relative_PATH) for relative_PATH in manifest['stages']['emit']['outputs']]
+
+
+"""
+intermediate results (kept in memory in a run and read from the files when resumed)
+"""
+def give_page_source(score):
+    #the leveled page decoded once for the staff detector (reduced) and the cropping (full resolution)
+    from imagesource.imagesource import PageImageSource
+    if 'page_source' not in score['memory']:
+        score['memory']['page_source'] = PageImageSource(score['LEVELED_FILE_PATH'])
+    return score['memory']['page_source']
+
+
+def give_aligned_staves(score):
+    if 'aligned_staves' not in score['memory']:
+        with open(score['PIPELINE_DIR'] + '/aligned_staves.json') as f:
+            score['memory']['aligned_staves'] = json.load(f)
+    return score['memory']['aligned_staves']
+
+
+def give_measure_images(score, key, MEASURE_PARENT_DIR):
+    #{'measure#000':img, ...} of staff1 and staff2 kept in memory by the stage making them,
+    #or read back from MEASURE_PARENT_DIR/measure/staff1 or staff2 when a run resumes after that stage
+    if key not in score['memory']:
+        from enlargemeasures.enlargeeachmeasure import load_measure_images
+        score['memory'][key] = (load_measure_images(MEASURE_PARENT_DIR + '/measure/staff1'), load_measure_images(MEASURE_PARENT_DIR + '/measure/staff2'))
+    return score['memory'][key]
+
+
+def give_parsed_symbols(score):
+    #all_ms_in_eachmeasure of staff1 and staff2
+    if 'parsed_symbols' not in score['memory']:
+        with open(score['PIPELINE_DIR'] + '/parsed_symbols.pickle', 'rb') as f:
+            score['memory']['parsed_symbols'] = pickle.load(f)
+    return score['memory']['parsed_symbols']
+
+
+def give_calibrations(score):
+    if 'calibrations' not in score['memory']:
+        with open(score['PIPELINE_DIR'] + '/calibration.json') as f:
+            calibrations = json.load(f)
+        score['memory']['calibrations'] = ({nameOfMeasure:tuple(alphabeta) for nameOfMeasure, alphabeta in calibrations['staff1'].items()},
+            {nameOfMeasure:tuple(alphabeta) for nameOfMeasure, alphabeta in calibrations['staff2'].items()})
+    return score['memory']['calibrations']
+
+
+def give_ms_sequences(score):
+    if 'ms_sequences' not in score['memory']:
+        with open(score['PIPELINE_DIR'] + '/ms_sequences.pickle', 'rb') as f:
+            score['memory']['ms_sequences'] = pickle.load(f)
+    return score['memory']['ms_sequences']
+
+
+def give_measure_image_PATHs(MEASURE_PARENT_DIR):
+    return glob.glob(MEASURE_PARENT_DIR + '/measure/staff1/measure#*') + glob.glob(MEASURE_PARENT_DIR + '/measure/staff2/measure#*')
+
+
+"""
+stages: each stage returns the paths of its output files
+"""
+def stage_level(score):
+    from leveloriginalimg.leveloriginalimg import leveloriginalimg
+    score['LEVELED_FILE_PATH'] = leveloriginalimg(score['FILE_PATH'])
+    #the leveled page is decoded again from the new file
+    score['memory'].pop('page_source', None)
+    return [score['LEVELED_FILE_PATH']]
+
+
+def stage_staff_detect(score):
+    from detectsymbols.detectsymbols import detect_staves, write_label_file
+    #the staff detector works at 416 pixels: a reduced decode of the page is enough
+    staff_labels = detect_staves(give_page_source(score).giveReducedImage(), conf_thres=score['settings']['staff_conf_thres'])
+    write_label_file(staff_labels, score['STAFF_LABEL_PATH'])
+    return [score['STAFF_LABEL_PATH']]
+
+
+def stage_align(score):
+    from alignmeasures.align_measures import generate_measures_in_eachstave_aslist
+    aligned_staves = generate_measures_in_eachstave_aslist(score['LEVELED_FILE_PATH'])
+    score['memory']['aligned_staves'] = aligned_staves
+    os.makedirs(score['PIPELINE_DIR'], exist_ok=True)
+    with open(score['PIPELINE_DIR'] + '/aligned_staves.json', 'w') as f:
+        json.dump(aligned_staves, f)
+    return [score['PIPELINE_DIR'] + '/aligned_staves.json']
+
+
+def stage_crop(score):
+    from enlargemeasures.enlargeeachmeasure import produceResizedMeasuresFromAlignedStaves, saveMeasureImages, clearMeasureImages
+    settings = score['settings']
+    measure_images = produceResizedMeasuresFromAlignedStaves(img_FILE_PATH=score['LEVELED_FILE_PATH'], aligned_staves=give_aligned_staves(score), isPaired=settings['areStavesPaired'], upper_margin=settings['staff_magnification'], lower_margin=settings['staff_magnification'], save_images=False, img_input=give_page_source(score).full)
+    #the page is not used by the later stages
+    give_page_source(score).release()
+    score['memory']['cropped_measure_images'] = measure_images
+    #the crops are kept losslessly so that a resumed run levels the same pixels
+    CROPPED_DIR = score['PIPELINE_DIR'] + '/cropped'
+    clearMeasureImages(CROPPED_DIR)
+    saveMeasureImages(CROPPED_DIR, *measure_images, '.png')
+    return give_measure_image_PATHs(CROPPED_DIR)
+
+
+def stage_level_measures(score):
+    from leveloriginalimg.leveloriginalimg import levelmeasureimages
+    from enlargemeasures.enlargeeachmeasure import saveMeasureImages, clearMeasureImages
+    measure_images_staff1, measure_images_staff2 = give_measure_images(score, 'cropped_measure_images', score['PIPELINE_DIR'] + '/cropped')
+    #level copies so that the crops in memory stay as they are
+    measure_images = (levelmeasureimages(dict(measure_images_staff1)), levelmeasureimages(dict(measure_images_staff2)))
+    #musicdata/AAA/measure/staff1/ or staff2/ as in detectionintegration.py, saved losslessly
+    #so that a resumed run (reading them back) detects and calibrates the same pixels as the images kept in memory
+    clearMeasureImages(score['dirname'])
+    saveMeasureImages(score['dirname'], *measure_images, '.png')
+    score['memory']['measure_images'] = measure_images
+    return give_measure_image_PATHs(score['dirname'])
+
+
+def stage_symbol_detect(score):
+    from detectsymbols.detectsymbols import SYMBOL_CATEGORIES, load_symbol_models, detect_symbols_in_measures, write_labels
+    load_symbol_models()
+    label_PATHs = []
+    for staff, measure_images in zip((1, 2), give_measure_images(score, 'measure_images', score['dirname'])):
+        SAVE_DIRECTORY_PATH = score['dirname'] + '/staff' + str(staff)
+        #remove the labels of a previous run (only measures with symbols have a label file)
+        for category in SYMBOL_CATEGORIES:
+            shutil.rmtree(SAVE_DIRECTORY_PATH + '/' + category + '/labels', ignore_errors=True)
+        if len(measure_images) == 0:
+            continue
+        detections = detect_symbols_in_measures(measure_images, conf_thres=score['settings']['symbol_conf_thres'])
+        write_labels(detections, SAVE_DIRECTORY_PATH)
+        label_PATHs += glob.glob(SAVE_DIRECTORY_PATH + '/*/labels/*.txt')
+    return label_PATHs
+
+
+def stage_parse(score):
+    #collect the musical symbols in the label files of each measure
+    from makeyolomusicdict.generatedictforxml import give_all_ms_in_eachmeasure_for_staff1or2
+    score['memory']['parsed_symbols'] = give_all_ms_in_eachmeasure_for_staff1or2(isPaired=score['settings']['areStavesPaired'], aligned_staves_input=give_aligned_staves(score), img_FILE_PATH=score['LEVELED_FILE_PATH'])
+    os.makedirs(score['PIPELINE_DIR'], exist_ok=True)
+    with open(score['PIPELINE_DIR'] + '/parsed_symbols.pickle', 'wb') as f:
+        pickle.dump(score['memory']['parsed_symbols'], f)
+    return [score['PIPELINE_DIR'] + '/parsed_symbols.pickle']
+
+
+def stage_calibrate(score):
+    from makeyolomusicdict.generatedictforxml import calibrateMeasures
+    calibrations = calibrateMeasures(*give_measure_images(score, 'measure_images', score['dirname']), max_workers=score['settings']['calibration_workers'])
+    score['memory']['calibrations'] = calibrations
+    os.makedirs(score['PIPELINE_DIR'], exist_ok=True)
+    with open(score['PIPELINE_DIR'] + '/calibration.json', 'w') as f:
+        json.dump({'staff1':calibrations[0], 'staff2':calibrations[1]}, f, indent=1)
+    return [score['PIPELINE_DIR'] + '/calibration.json']
+
+
+def stage_annotate(score):
+    from makeyolomusicdict.generatedictforxml import setCurrentAccidentalTable, generateMSsequenceForStaff1or2, Clef
+    settings = score['settings']
+    all_ms_in_eachmeasure_staff1, all_ms_in_eachmeasure_staff2 = give_parsed_symbols(score)
+    alphabetas_staff1, alphabetas_staff2 = give_calibrations(score)
+    preset_measure_duration = 1024 * settings['beats'] / settings['beat_type']
+    current_accidental_table_template ={'A':'', 'B':'', 'C':'', 'D':'', 'E':'', 'F':'', 'G':''}
+    current_accidental_table = setCurrentAccidentalTable(current_accidental_table_template, settings['fifths'])
+    ms_sequenceOfInterest_staff1 = generateMSsequenceForStaff1or2(all_ms_in_eachmeasure_input=all_ms_in_eachmeasure_staff1, current_accidental_table_input=current_accidental_table, staff=1, current_clef_input=Clef[settings['clef_staff1']], preset_measure_duration=preset_measure_duration, FILE_PATH=score['LEVELED_FILE_PATH'], isWideStaff=settings['isWideStaff'], alphabetas=alphabetas_staff1)
+    ms_sequenceOfInterest_staff2 = generateMSsequenceForStaff1or2(all_ms_in_eachmeasure_input=all_ms_in_eachmeasure_staff2, current_accidental_table_input=current_accidental_table, staff=2, current_clef_input=Clef[settings['clef_staff2']], preset_measure_duration=preset_measure_duration, FILE_PATH=score['LEVELED_FILE_PATH'], isWideStaff=settings['isWideStaff'], alphabetas=alphabetas_staff2)
+    score['memory']['ms_sequences'] = (ms_sequenceOfInterest_staff1, ms_sequenceOfInterest_staff2)
+    os.makedirs(score['PIPELINE_DIR'], exist_ok=True)
+    with open(score['PIPELINE_DIR'] + '/ms_sequences.pickle', 'wb') as f:
+        pickle.dump(score['memory']['ms_sequences'], f)
+    return [score['PIPELINE_DIR'] + '/ms_sequences.pickle']
+
+
+def stage_emit(score):
+    from makeyolomusicdict.generatedictforxml import giveMeasureDictsForET_singlestaff, Clef
+    from yoloToxml.yoloToxml import writeMusicXMLVariants
+    settings = score['settings']
+    measures = []
+    for staff, ms_sequenceOfInterest in zip((1, 2), give_ms_sequences(score)):
+        clef = Clef[settings['clef_staff' + str(staff)]]
+        #the measures of both staves are generated and written in one pass
+        measures.append(giveMeasureDictsForET_singlestaff(ms_sequenceOfInterest_staff_input=ms_sequenceOfInterest, tempo=settings['tempo'], beats=settings['beats'], beat_type=settings['beat_type'], fifths=settings['fifths'], clef=clef))
+    xml_filepaths = {variant:score['XML_PATH_PREFIX'] + '_' + variant + '.' + settings['xml_format'] for variant in settings['xml_variants']}
+    return writeMusicXMLVariants(measures[0], measures[1], xml_filepaths, indent=settings['xml_indent'])
+
+
+STAGE_FUNCTIONS = {
+    'level':stage_level,
+    'staff-detect':stage_staff_detect,
+    'align':stage_align,
+    'crop':stage_crop,
+    'level-measures':stage_level_measures,
+    'symbol-detect':stage_symbol_detect,
+    'parse':stage_parse,
+    'calibrate':stage_calibrate,
+    'annotate':stage_annotate,
+    'emit':stage_emit,
+}
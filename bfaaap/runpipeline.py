@@ -0,0 +1,63 @@
+# coding: UTF-8
+"""
+From sheet music img files, perform all the stages (level, staff-detect, align, crop, level-measures, symbol-detect, parse, calibrate, annotate, emit)
+e.g., python runpipeline.py musicdata/emisan/sarabande.jpg --fifths -1 --beats 3 --beat-type 2
+the stages already done with the same inputs and settings are skipped (see musicdata/AAA/pipeline/BBB/manifest.json),
+so that an interrupted batch resumes from the first stale stage of each score
+"""
+import argparse
+import time
+import traceback
+
+from pipeline.pipeline import STAGES, DEFAULT_SETTINGS, run_pipeline
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('files', nargs='+', help='sheet music images (.jpg or .png)')
+    parser.add_argument('--until', default='emit', choices=STAGES, help='the last stage to run')
+    parser.add_argument('--force', action='store_true', help='run all the stages even if they are up to date')
+    parser.add_argument('--not-paired', action='store_true', help='staves are not paired (single staff)')
+    parser.add_argument('--wide-staff', action='store_true')
+    parser.add_argument('--staff-magnification', type=float, default=DEFAULT_SETTINGS['staff_magnification'])
+    parser.add_argument('--tempo', type=int, default=DEFAULT_SETTINGS['tempo'])
+    parser.add_argument('--beats', type=int, default=DEFAULT_SETTINGS['beats'])
+    parser.add_argument('--beat-type', type=int, default=DEFAULT_SETTINGS['beat_type'])
+    parser.add_argument('--fifths', type=int, default=DEFAULT_SETTINGS['fifths'])
+    parser.add_argument('--clef-staff1', default=DEFAULT_SETTINGS['clef_staff1'], choices=['G', 'F', 'G8va', 'F8vb'])
+    parser.add_argument('--clef-staff2', default=DEFAULT_SETTINGS['clef_staff2'], choices=['G', 'F', 'G8va', 'F8vb'])
+    parser.add_argument('--variants', nargs='+', default=DEFAULT_SETTINGS['xml_variants'], choices=['staff1', 'staff2', 'staves1and2'], help='the musicXML files to write')
+    parser.add_argument('--compact-xml', action='store_true', help='write musicXML files without indentation')
+    parser.add_argument('--mxl', action='store_true', help='write compressed musicXML files (.mxl) instead of .xml')
+    parser.add_argument('--trace', action='store_true', help='also save musicdata/AAA/pipeline/BBB/trace.json for chrome://tracing')
+    parser.add_argument('--workers', type=int, default=None, help='worker processes for calibration (default: the number of CPUs)')
+    opt = parser.parse_args()
+
+    settings = {
+        'areStavesPaired':not opt.not_paired,
+        'isWideStaff':opt.wide_staff,
+        'staff_magnification':opt.staff_magnification,
+        'tempo':opt.tempo,
+        'beats':opt.beats,
+        'beat_type':opt.beat_type,
+        'fifths':opt.fifths,
+        'clef_staff1':opt.clef_staff1,
+        'clef_staff2':opt.clef_staff2,
+        'calibration_workers':opt.workers,
+        'xml_variants':opt.variants,
+        'xml_indent':None if opt.compact_xml else DEFAULT_SETTINGS['xml_indent'],
+        'xml_format':'mxl' if opt.mxl else DEFAULT_SETTINGS['xml_format'],
+    }
+    failed_files = []
+    for FILE_PATH in opt.files:
+        start = time.time()
+        print(f'### {FILE_PATH}')
+        try:
+            run_pipeline(FILE_PATH, settings=settings, until=opt.until, force=opt.force, trace=opt.trace)
+        except Exception:
+            #go on with the other scores; the failed one resumes from the failed stage next time
+            traceback.print_exc()
+            failed_files.append(FILE_PATH)
+        print("elapsed_time:{0}".format(time.time() - start) + "[sec]")
+    if len(failed_files) > 0:
+        print(f'failed: {failed_files}')
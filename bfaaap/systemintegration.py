@@ -96,16 +96,23 @@ isWideStaff = False
 
 
 from makeyolomusicdict.generatedictforxml import setCurrentAccidentalTable, generateMSsequenceForStaff1or2, Clef
+from makeyolomusicdict.generatedictforxml import giveMeasureImagesForStaff1or2, calibrateMeasures
+
+#determine alpha and beta of all measures in staff1 and staff2 at once in a process pool
+calibration_workers = None #None: the number of CPUs
+measure_images_staff1 = giveMeasureImagesForStaff1or2(all_ms_in_eachmeasure_staff1, staff=1, FILE_PATH=FILE_PATH)
+measure_images_staff2 = giveMeasureImagesForStaff1or2(all_ms_in_eachmeasure_staff2, staff=2, FILE_PATH=FILE_PATH)
+alphabetas_staff1, alphabetas_staff2 = calibrateMeasures(measure_images_staff1, measure_images_staff2, max_workers=calibration_workers)
 
 #classはimportすること
 current_clef = Clef.G
 current_accidental_table_template ={'A':'', 'B':'', 'C':'', 'D':'', 'E':'', 'F':'', 'G':''}
 current_accidental_table = setCurrentAccidentalTable(current_accidental_table_template, fifths)
-ms_sequenceOfInterest_staff1 = generateMSsequenceForStaff1or2(all_ms_in_eachmeasure_input=all_ms_in_eachmeasure_staff1, current_accidental_table_input=current_accidental_table, staff=1, current_clef_input=current_clef, preset_measure_duration=preset_measure_duration, FILE_PATH=FILE_PATH, isWideStaff=isWideStaff)
+ms_sequenceOfInterest_staff1 = generateMSsequenceForStaff1or2(all_ms_in_eachmeasure_input=all_ms_in_eachmeasure_staff1, current_accidental_table_input=current_accidental_table, staff=1, current_clef_input=current_clef, preset_measure_duration=preset_measure_duration, FILE_PATH=FILE_PATH, isWideStaff=isWideStaff, measure_images=measure_images_staff1, alphabetas=alphabetas_staff1)
 
 #for staff2: check current_clef
 current_clef = Clef.F
-ms_sequenceOfInterest_staff2 = generateMSsequenceForStaff1or2(all_ms_in_eachmeasure_input=all_ms_in_eachmeasure_staff2, current_accidental_table_input=current_accidental_table, staff=2, current_clef_input=current_clef, preset_measure_duration=preset_measure_duration, FILE_PATH=FILE_PATH, isWideStaff=isWideStaff)
+ms_sequenceOfInterest_staff2 = generateMSsequenceForStaff1or2(all_ms_in_eachmeasure_input=all_ms_in_eachmeasure_staff2, current_accidental_table_input=current_accidental_table, staff=2, current_clef_input=current_clef, preset_measure_duration=preset_measure_duration, FILE_PATH=FILE_PATH, isWideStaff=isWideStaff, measure_images=measure_images_staff2, alphabetas=alphabetas_staff2)
 
 print(f'staves_with_measures_in_sheetmusicのstave数は{len(staves_with_measures_in_sheetmusic)}')
 for i, each_staff in enumerate(staves_with_measures_in_sheetmusic):
@@ -120,117 +127,19 @@ print(f'ms_sequenceOfInterest_staff2の要素数は{len(ms_sequenceOfInterest_st
 # print(f'ms_sequenceOfInterest_staff1の[6:8]は\n{ms_sequenceOfInterest_staff1[6:8]}')
 
 """
-generate a dictionary for ET
+generate musicXML files (staff1, staff2 and staves1and2) in one pass
 
 """
-from makeyolomusicdict.generatedictforxml import generateDictForET_singlestaff, generateDictForET_twostaves
+from makeyolomusicdict.generatedictforxml import giveMeasureDictsForET_singlestaff
+from yoloToxml.yoloToxml import writeMusicXMLVariants
 
-#for staff1
 current_staff1_clef = Clef.G
-dictionary_for_ET_staff1 = generateDictForET_singlestaff(ms_sequenceOfInterest_staff_input=ms_sequenceOfInterest_staff1, tempo=tempo, beats=beats, beat_type=beat_type, fifths=fifths, clef=current_staff1_clef)
-part_content1 = dictionary_for_ET_staff1['part']
-print(f'dictionary_for_ET_staff1[0]の要素の数は\n{len(part_content1)}')
-#for staff2
 current_staff2_clef = Clef.F
-dictionary_for_ET_staff2 = generateDictForET_singlestaff(ms_sequenceOfInterest_staff_input=ms_sequenceOfInterest_staff2, tempo=tempo, beats=beats, beat_type=beat_type, fifths=fifths, clef=current_staff2_clef)
-part_content2 = dictionary_for_ET_staff2['part']
-print(f'dictionary_for_ET_staff2[0]の要素の数は\n{len(part_content2)}')
-# print(f'part_content1とpart_contentは同じですか{part_content1 == part_content2}')
-
 print(f'current_staff1_clef:{current_staff1_clef}\ncurrent_staff2_clef:{current_staff2_clef}')
-#for both staff1 and staff2
-dictionary_for_ET_staves1and2 = generateDictForET_twostaves(ms_sequence_staff1_input=ms_sequenceOfInterest_staff1, ms_sequence_staff2_input=ms_sequenceOfInterest_staff2, tempo=tempo, beats=beats, beat_type=beat_type, fifths=fifths, clef_staff1_input=current_staff1_clef, clef_staff2_input=current_staff2_clef)
-part_content1and2 = dictionary_for_ET_staves1and2['part']
-print(f'dictionary_for_ET_staves1and2[0]の要素の数は\n{len(part_content1and2)}')
-
-#generate XML
-from yoloToxml.yoloToxml import musicData2XML
-import xml.etree.ElementTree as ET
-from xml.dom import minidom
-
-"""
-#for staff1
-"""
-part_et = ET.Element('part')
-part_et.attrib = {'id':'P1'}
-part_et_1 = musicData2XML(part_et, dictionary_for_ET_staff1)
-
-xmlstr_1 = minidom.parseString(ET.tostring(part_et_1)).toprettyxml(indent="   ")
-
-#1行目の<?xml version="1.0"　?>を除く：　　結合するため
-xmlstr_1 = xmlstr_1[23:]
-# print(xmlstr_1)
-# print(f'XML化した結果データは{xmlstr_1}')                
-
-#template.xmlファイルを読み込んで得られたpart_etのXMLデータと結合して全体XMLを作る
-wholeXML_staff1_text = ""
-with open("/Users/tomoimacpro/TSh_project/bfaaap/yoloToxml/template.xml", 'r') as f:
-    template_text = f.read()
-    wholeXML_staff1_text = template_text +'\n' + xmlstr_1 +'\n</score-partwise>'
-
-#save the resulting xml in ./xml/ directory
-FILE_DIR_PATH
-new_dir_path = FILE_DIR_PATH + '/xml'
-os.makedirs(new_dir_path, exist_ok=True)
-new_xml_filepath = new_dir_path + '/' + FILE_BASENAME_WITHOUTEXT + '_staff1.xml'
-with open(new_xml_filepath, 'w') as f:
-    f.write(wholeXML_staff1_text)
-
-"""
-#for staff2
-"""
-part_et = ET.Element('part')
-part_et.attrib = {'id':'P1'}
-part_et_2 = musicData2XML(part_et, dictionary_for_ET_staff2)
+measures_staff1 = giveMeasureDictsForET_singlestaff(ms_sequenceOfInterest_staff_input=ms_sequenceOfInterest_staff1, tempo=tempo, beats=beats, beat_type=beat_type, fifths=fifths, clef=current_staff1_clef)
+measures_staff2 = giveMeasureDictsForET_singlestaff(ms_sequenceOfInterest_staff_input=ms_sequenceOfInterest_staff2, tempo=tempo, beats=beats, beat_type=beat_type, fifths=fifths, clef=current_staff2_clef)
 
-xmlstr_2 = minidom.parseString(ET.tostring(part_et_2)).toprettyxml(indent="   ")
-
-#1行目の<?xml version="1.0"　?>を除く：　　結合するため
-xmlstr_2 = xmlstr_2[23:]
-# print(xmlstr_1)
-# print(f'XML化した結果データは{xmlstr_1}')                
-
-#template.xmlファイルを読み込んで得られたpart_etのXMLデータと結合して全体XMLを作る
-wholeXML_staff2_text = ""
-with open("/Users/tomoimacpro/TSh_project/bfaaap/yoloToxml/template.xml", 'r') as f:
-    template_text = f.read()
-    wholeXML_staff2_text = template_text +'\n' + xmlstr_2 +'\n</score-partwise>'
-
-#save the resulting xml in ./xml/ directory
-FILE_DIR_PATH
-new_dir_path = FILE_DIR_PATH + '/xml'
-os.makedirs(new_dir_path, exist_ok=True)
-new_xml_filepath = new_dir_path + '/' + FILE_BASENAME_WITHOUTEXT + '_staff2.xml'
-with open(new_xml_filepath, 'w') as f:
-    f.write(wholeXML_staff2_text)
-
-
-"""
-#for both staff1 and staff2
-"""
-part_et = ET.Element('part')
-part_et.attrib = {'id':'P1'}
-part_et_1and2 = musicData2XML(part_et, dictionary_for_ET_staves1and2)
-
-xmlstr_1and2 = minidom.parseString(ET.tostring(part_et_1and2)).toprettyxml(indent="   ")
-
-#1行目の<?xml version="1.0"　?>を除く：　　結合するため
-xmlstr_1and2 = xmlstr_1and2[23:]
-# print(xmlstr_1)
-# print(f'XML化した結果データは{xmlstr_1}')                
-
-#template.xmlファイルを読み込んで得られたpart_etのXMLデータと結合して全体XMLを作る
-wholeXML_staves1and2_text = ""
-with open("/Users/tomoimacpro/TSh_project/bfaaap/yoloToxml/template.xml", 'r') as f:
-    template_text = f.read()
-    wholeXML_staves1and2_text = template_text +'\n' + xmlstr_1and2 +'\n</score-partwise>'
-
-#save the resulting xml in ./xml/ directory
-FILE_DIR_PATH
+#save the resulting xml in ./xml/ directory (remove a variant to skip it)
 new_dir_path = FILE_DIR_PATH + '/xml'
-os.makedirs(new_dir_path, exist_ok=True)
-new_xml_filepath = new_dir_path + '/' + FILE_BASENAME_WITHOUTEXT + '_staves1and2.xml'
-with open(new_xml_filepath, 'w') as f:
-    f.write(wholeXML_staves1and2_text)
-
-
+xml_filepaths = {variant:new_dir_path + '/' + FILE_BASENAME_WITHOUTEXT + '_' + variant + '.xml' for variant in ('staff1', 'staff2', 'staves1and2')}
+writeMusicXMLVariants(measures_staff1, measures_staff2, xml_filepaths)
@@ -5,7 +5,17 @@
 
 #To generate an element tree from Yolov5 data
 import xml.etree.ElementTree as ET
+from xml.dom import minidom
 import copy
+import io
+import itertools
+import os
+import zipfile
+from contextlib import contextmanager, ExitStack
+
+from instrumentation.instrumentation import instrument, span
+
+TEMPLATE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'template.xml')
 
 """
 music_data = {
@@ -217,6 +227,7 @@ music_data = {
 part_et = ET.Element('part')
 part_et.attrib = {'id':'P1'}
 
+@instrument()
 def musicData2XML(part_et, music_data):
     for part, measures_value in music_data.items():
         for measure, measure_value in measures_value.items():
@@ -301,11 +312,304 @@ def musicData2XML(part_et, music_data):
     return part_et
 
 
+"""
+streaming writer
+the measures are serialized one by one with the same elements as musicData2XML and the same layout as
+minidom's toprettyxml(indent), so that the whole tree is never built (nor parsed again) in memory
+indent=None writes a compact musicXML without any whitespace between the elements
+"""
+DEFAULT_INDENT = '   '
+
+def escapeXMLText(text):
+    #as minidom escapes texts and attribute values
+    return text.replace('&', '&amp;').replace('<', '&lt;').replace('"', '&quot;').replace('>', '&gt;')
+
+def giveStartTagXML(tag, attrib=None):
+    if not attrib:
+        return '<' + tag
+    return '<' + tag + ''.join(' ' + name + '="' + escapeXMLText(str(value)) + '"' for name, value in attrib.items())
+
+def giveElementXML(tag, text, depth, indent, attrib=None):
+    #an element with a text only (an empty element if the text is '')
+    if indent is None:
+        prefix, newline = '', ''
+    else:
+        prefix, newline = indent * depth, '\n'
+    if text == '' or text is None:
+        return prefix + giveStartTagXML(tag, attrib) + '/>' + newline
+    return prefix + giveStartTagXML(tag, attrib) + '>' + escapeXMLText(text) + '</' + tag + '>' + newline
+
+def giveParentXML(tag, children, depth, indent, attrib=None):
+    #an element with child elements (children: a list of serialized child elements)
+    if indent is None:
+        prefix, newline = '', ''
+    else:
+        prefix, newline = indent * depth, '\n'
+    if len(children) == 0:
+        return prefix + giveStartTagXML(tag, attrib) + '/>' + newline
+    return prefix + giveStartTagXML(tag, attrib) + '>' + newline + ''.join(children) + prefix + '</' + tag + '>' + newline
+
+def giveAttributesXML(attributes_value, depth, indent):
+    children = []
+    for attributes_key, attributes_value in attributes_value.items():
+        if not isinstance(attributes_value, dict):
+            children.append(giveElementXML(attributes_key, attributes_value, depth + 1, indent))
+        else:
+            subchildren = [giveElementXML(key, value, depth + 2, indent) for key, value in attributes_value.items() if key != 'attrib']
+            children.append(giveParentXML(attributes_key, subchildren, depth + 1, indent, attrib=attributes_value.get('attrib')))
+    return giveParentXML('attributes', children, depth, indent)
+
+def giveDirectionXML(direction_value, depth, indent):
+    children = []
+    for direction_key, direction_value in direction_value.items():
+        if direction_key == 'direction-type':
+            subchildren = [giveParentXML('octave-shift', [], depth + 2, indent, attrib=value) for key, value in direction_value.items() if key == 'octave-shift']
+            children.append(giveParentXML('direction-type', subchildren, depth + 1, indent))
+    return giveParentXML('direction', children, depth, indent)
+
+def giveNoteChildrenXML(note_value, depth, indent):
+    #[(note_key, serialized child element)] of a note, so that a variant can replace some of them (e.g., voice, staff)
+    children = []
+    for note_key, note_value in note_value.items():
+        if not isinstance(note_value, dict):
+            children.append((note_key, giveElementXML(note_key, note_value, depth + 1, indent)))
+        elif note_key == 'pitch':
+            subchildren = [giveElementXML(key, value, depth + 2, indent) for key, value in note_value.items()]
+            children.append((note_key, giveParentXML(note_key, subchildren, depth + 1, indent)))
+        elif note_key == 'beam':
+            children.append((note_key, giveElementXML(note_key, note_value.get('content', ''), depth + 1, indent, attrib={'number':note_value['number']} if 'number' in note_value else None)))
+        else:
+            print(f'Another note item  is {note_key}.')
+    return children
+
+def giveNoteXML(note_value, depth, indent):
+    return giveParentXML('note', [child for note_key, child in giveNoteChildrenXML(note_value, depth, indent)], depth, indent)
+
+def isNoteItem(measure_key, measure_value):
+    #whether musicData2XML converts the item of a measure into a note
+    return isinstance(measure_value, dict) and not (measure_key == 'attributes' or measure_key == 'attributes1' or measure_key == 'attributes_added') and not (measure_key == 'direction0' or measure_key == 'direction1' or measure_key == 'direction2')
+
+def giveMeasureChildXML(measure_key, measure_value, depth, indent):
+    #one item of a measure in music_data (except 'attrib') as musicData2XML converts it
+    if not isinstance(measure_value, dict): # key value pair
+        return giveElementXML(measure_key, measure_value, depth, indent)
+    elif measure_key == 'attributes' or measure_key == 'attributes1' or measure_key == 'attributes_added':
+        return giveAttributesXML(measure_value, depth, indent)
+    elif measure_key == 'direction0' or measure_key == 'direction1' or measure_key == 'direction2':
+        return giveDirectionXML(measure_value, depth, indent)
+    else:  # dict and key=note
+        return giveNoteXML(measure_value, depth, indent)
+
+def giveMeasureXML(measure_value, depth=1, indent=DEFAULT_INDENT):
+    children = [giveMeasureChildXML(measure_key, value, depth + 1, indent) for measure_key, value in measure_value.items() if measure_key != 'attrib']
+    return giveParentXML('measure', children, depth, indent, attrib=measure_value.get('attrib'))
+
+class MusicXMLPartWriter:
+    #writes a musicXML text measure by measure: the header in template.xml, the part with the measures and the end tag
+    def __init__(self, stream, template_text, indent=DEFAULT_INDENT):
+        self.stream = stream
+        self.newline = '' if indent is None else '\n'
+        self.measure_count = 0
+        self.stream.write(template_text + '\n')
+
+    def writeMeasure(self, measure_xml):
+        if self.measure_count == 0:
+            self.stream.write('<part id="P1">' + self.newline)
+        self.stream.write(measure_xml)
+        self.measure_count += 1
+
+    def close(self):
+        if self.measure_count == 0:
+            self.stream.write('<part id="P1"/>' + self.newline)
+        else:
+            self.stream.write('</part>' + self.newline)
+        self.stream.write('\n</score-partwise>')
 
+@instrument()
+def writeMusicXMLStream(measures, stream, template_text, indent=DEFAULT_INDENT):
+    #measures: an iterable of the measure dictionaries (e.g., a generator yielding them one by one)
+    part_writer = MusicXMLPartWriter(stream, template_text, indent)
+    for measure_value in measures:
+        part_writer.writeMeasure(giveMeasureXML(measure_value, 1, indent))
+    part_writer.close()
+
+def readTemplateText(template_path=TEMPLATE_PATH):
+    with open(template_path, 'r') as f:
+        return f.read()
+
+def giveMeasuresOfMusicData(music_data):
+    for part, measures_value in music_data.items():
+        for measure, measure_value in measures_value.items():
+            yield measure_value
+
+def giveMusicXMLText(music_data, template_text, indent=DEFAULT_INDENT):
+    #a whole musicXML text: the header in template.xml followed by the part generated from music_data
+    stream = io.StringIO()
+    writeMusicXMLStream(giveMeasuresOfMusicData(music_data), stream, template_text, indent)
+    return stream.getvalue()
+
+def giveMusicXMLTextByMinidom(music_data, template_text):
+    #the former way (ElementTree and minidom); the same text as giveMusicXMLText
+    part_et = ET.Element('part')
+    part_et.attrib = {'id':'P1'}
+    part_et = musicData2XML(part_et, music_data)
+    with span('minidom prettyprint'):
+        xmlstr = minidom.parseString(ET.tostring(part_et)).toprettyxml(indent="   ")
+    #1行目の<?xml version="1.0"　?>を除く：　　結合するため
+    xmlstr = xmlstr[23:]
+    return template_text +'\n' + xmlstr +'\n</score-partwise>'
+
+"""
+compressed musicXML (.mxl)
+a zip file with META-INF/container.xml pointing to the score (xxx.xml) in it; the score is streamed straight into its zip entry
+"""
+MXL_MIMETYPE = 'application/vnd.recordare.musicxml'
+MXL_CONTAINER_TEXT = """<?xml version="1.0" encoding="UTF-8"?>
+<container>
+  <rootfiles>
+    <rootfile full-path="{}" media-type="application/vnd.recordare.musicxml+xml"/>
+  </rootfiles>
+</container>
+"""
+
+@contextmanager
+def openMusicXMLFile(xml_filepath):
+    #a text stream to write a musicXML file: a plain file for .xml, the entry of the score in a zip file for .mxl
+    os.makedirs(os.path.dirname(xml_filepath), exist_ok=True)
+    if os.path.splitext(xml_filepath)[1] != '.mxl':
+        with open(xml_filepath, 'w') as f:
+            yield f
+        return
+    score_name = os.path.splitext(os.path.basename(xml_filepath))[0] + '.xml'
+    with zipfile.ZipFile(xml_filepath, 'w', compression=zipfile.ZIP_DEFLATED) as mxl:
+        #the mimetype first and uncompressed, as the specification recommends
+        mxl.writestr(zipfile.ZipInfo('mimetype'), MXL_MIMETYPE, compress_type=zipfile.ZIP_STORED)
+        mxl.writestr('META-INF/container.xml', MXL_CONTAINER_TEXT.format(score_name))
+        with mxl.open(score_name, 'w') as entry, io.TextIOWrapper(entry, encoding='utf-8') as f:
+            yield f
+
+def writeMusicXMLFromMeasures(measures, xml_filepath, template_path=TEMPLATE_PATH, indent=DEFAULT_INDENT):
+    #measures: an iterable of the measure dictionaries, written to the file as they come (.mxl: compressed)
+    template_text = readTemplateText(template_path)
+    with openMusicXMLFile(xml_filepath) as f:
+        writeMusicXMLStream(measures, f, template_text, indent)
+    return xml_filepath
+
+def writeMusicXML(music_data, xml_filepath, template_path=TEMPLATE_PATH, indent=DEFAULT_INDENT):
+    return writeMusicXMLFromMeasures(giveMeasuresOfMusicData(music_data), xml_filepath, template_path, indent)
+
+
+"""
+single-pass emitter of the variants
+staff1 and staff2 (each staff as a single-staff score) and staves1and2 (both staves in one part with staves=2) are written
+at once from the measure dictionaries of the two staves; each item of a measure is serialized only once and shared by the variants
+(in staves1and2, only the voice and the staff of the notes in staff2 and the clef number of its clef changes are serialized again)
+"""
+VARIANTS = ('staff1', 'staff2', 'staves1and2')
+#the voices of staff2 in staves1and2 (1, 2 -> 5, 6) so as not to be merged with the voices of staff1
+STAFF2_VOICE_OFFSET = 4
 
+def giveMeasureFragments(measure_value, depth, indent):
+    #[(measure_key, measure_value, serialized item)], where the serialized item of a note is the list of its serialized children
+    fragments = []
+    for measure_key, value in measure_value.items():
+        if measure_key == 'attrib':
+            continue
+        if isNoteItem(measure_key, value):
+            fragments.append((measure_key, value, giveNoteChildrenXML(value, depth, indent)))
+        else:
+            fragments.append((measure_key, value, giveMeasureChildXML(measure_key, value, depth, indent)))
+    return fragments
 
+def giveFragmentXML(measure_key, measure_value, fragment, depth, indent):
+    if isNoteItem(measure_key, measure_value):
+        return giveParentXML('note', [child for note_key, child in fragment], depth, indent)
+    return fragment
 
+def giveFragmentXMLForStaff2(measure_key, measure_value, fragment, depth, indent):
+    #the item of staff2 placed in staves1and2
+    if isNoteItem(measure_key, measure_value):
+        children = []
+        for note_key, child in fragment:
+            if note_key == 'voice':
+                child = giveElementXML('voice', str(int(measure_value['voice']) + STAFF2_VOICE_OFFSET), depth + 1, indent)
+            elif note_key == 'staff':
+                child = giveElementXML('staff', '2', depth + 1, indent)
+            children.append(child)
+        return giveParentXML('note', children, depth, indent)
+    if measure_key == 'attributes_added' and 'clef' in measure_value:
+        attributes_value = dict(measure_value, clef=dict(measure_value['clef'], attrib={'number':'2'}))
+        return giveAttributesXML(attributes_value, depth, indent)
+    return fragment
 
+def giveAttributesXMLForStaves1and2(attributes_staff1, attributes_staff2, depth, indent):
+    #the first attributes of staff1 with staves=2 and the clefs of both staves
+    children = []
+    for attributes_key, attributes_value in attributes_staff1.items():
+        if attributes_key == 'staves':
+            children.append(giveElementXML('staves', '2', depth + 1, indent))
+        elif attributes_key == 'clef':
+            for staff, clef_value in (('1', attributes_value), ('2', attributes_staff2.get('clef'))):
+                if clef_value is None:
+                    continue
+                subchildren = [giveElementXML(key, value, depth + 2, indent) for key, value in clef_value.items() if key != 'attrib']
+                children.append(giveParentXML('clef', subchildren, depth + 1, indent, attrib={'number':staff}))
+        elif not isinstance(attributes_value, dict):
+            children.append(giveElementXML(attributes_key, attributes_value, depth + 1, indent))
+        else:
+            subchildren = [giveElementXML(key, value, depth + 2, indent) for key, value in attributes_value.items() if key != 'attrib']
+            children.append(giveParentXML(attributes_key, subchildren, depth + 1, indent, attrib=attributes_value.get('attrib')))
+    return giveParentXML('attributes', children, depth, indent)
 
+def giveMeasureDuration(measure_value):
+    #the duration of the notes (except the chord notes) in a measure, to move back to the start of the measure for staff2
+    duration = 0
+    for measure_key, value in measure_value.items():
+        if isNoteItem(measure_key, value) and not 'chord' in value and 'duration' in value:
+            duration += int(value['duration'])
+    return duration
 
+def giveMeasureXMLForStaves1and2(measure_staff1, fragments_staff1, measure_staff2, fragments_staff2, depth, indent):
+    attrib = (measure_staff1 if measure_staff1 is not None else measure_staff2).get('attrib')
+    children = []
+    isAttributesMerged = measure_staff1 is not None and measure_staff2 is not None and 'attributes' in measure_staff1 and 'attributes' in measure_staff2
+    if measure_staff1 is not None:
+        for measure_key, measure_value, fragment in fragments_staff1:
+            if isAttributesMerged and measure_key == 'attributes':
+                children.append(giveAttributesXMLForStaves1and2(measure_value, measure_staff2['attributes'], depth + 1, indent))
+            else:
+                children.append(giveFragmentXML(measure_key, measure_value, fragment, depth + 1, indent))
+    if measure_staff2 is not None:
+        backup_duration = giveMeasureDuration(measure_staff1) if measure_staff1 is not None else 0
+        if backup_duration > 0:
+            children.append(giveParentXML('backup', [giveElementXML('duration', str(backup_duration), depth + 2, indent)], depth + 1, indent))
+        for measure_key, measure_value, fragment in fragments_staff2:
+            if isAttributesMerged and measure_key == 'attributes':
+                continue
+            children.append(giveFragmentXMLForStaff2(measure_key, measure_value, fragment, depth + 1, indent))
+    return giveParentXML('measure', children, depth, indent, attrib=attrib)
 
+@instrument()
+def writeMusicXMLVariants(measures_staff1, measures_staff2, xml_filepaths, template_path=TEMPLATE_PATH, indent=DEFAULT_INDENT):
+    #measures_staff1, measures_staff2: iterables of the measure dictionaries of each staff (e.g., giveMeasureDictsForET_singlestaff)
+    #xml_filepaths: {variant: xml_filepath} of the variants to write (see VARIANTS); the others are skipped (.mxl: compressed)
+    for variant in xml_filepaths:
+        if not variant in VARIANTS:
+            raise ValueError(f'unknown variant {variant} (one of {VARIANTS})')
+    template_text = readTemplateText(template_path)
+    part_writers = {}
+    with ExitStack() as stack:
+        for variant, xml_filepath in xml_filepaths.items():
+            part_writers[variant] = MusicXMLPartWriter(stack.enter_context(openMusicXMLFile(xml_filepath)), template_text, indent)
+        for measure_staff1, measure_staff2 in itertools.zip_longest(measures_staff1, measures_staff2):
+            fragments_staff1 = giveMeasureFragments(measure_staff1, 2, indent) if measure_staff1 is not None else None
+            fragments_staff2 = giveMeasureFragments(measure_staff2, 2, indent) if measure_staff2 is not None else None
+            for staff, measure_value, fragments in (('staff1', measure_staff1, fragments_staff1), ('staff2', measure_staff2, fragments_staff2)):
+                if staff in part_writers and measure_value is not None:
+                    children = [giveFragmentXML(measure_key, value, fragment, 2, indent) for measure_key, value, fragment in fragments]
+                    part_writers[staff].writeMeasure(giveParentXML('measure', children, 1, indent, attrib=measure_value.get('attrib')))
+            if 'staves1and2' in part_writers:
+                part_writers['staves1and2'].writeMeasure(giveMeasureXMLForStaves1and2(measure_staff1, fragments_staff1, measure_staff2, fragments_staff2, 1, indent))
+        for part_writer in part_writers.values():
+            part_writer.close()
+    return list(xml_filepaths.values())